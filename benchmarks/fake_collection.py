@@ -0,0 +1,128 @@
+"""
+An in-memory stand-in for the pymongo Collection used by the updaters and CardSnapshot,
+so that they can be benchmarked without a MongoDB server.
+
+Only what the updaters use is supported: equality, $in and $exists filters (with dotted paths
+through embedded documents), and $set, $setOnInsert and $addToSet updates. Updates of
+array elements through the positional "$" operator (changed card prices) and update pipelines
+(price summaries) are counted but not applied.
+"""
+import copy
+from collections import Counter
+from typing import Any, Iterator, Optional
+
+from pymongo.results import BulkWriteResult
+
+MISSING = object()
+
+
+def get_path(document: dict, path: str) -> Any:
+    value = document
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return MISSING
+        value = value[key]
+
+    return value
+
+
+def set_path(document: dict, path: str, value: Any):
+    keys = path.split(".")
+    for key in keys[:-1]:
+        document = document.setdefault(key, {})
+    document[keys[-1]] = value
+
+
+def matches(document: dict, filter: dict) -> bool:
+    for path, expected in filter.items():
+        value = get_path(document, path)
+        if isinstance(expected, dict) and "$exists" in expected:
+            if (value is not MISSING) != expected["$exists"]:
+                return False
+        elif isinstance(expected, dict) and "$in" in expected:
+            if value is MISSING or value not in expected["$in"]:
+                return False
+        elif value is MISSING or value != expected:
+            return False
+
+    return True
+
+
+class FakeCollection:
+    def __init__(self, documents: Optional[list[dict]] = None, name: str = "cards"):
+        self.name = name
+        self.documents = documents or []
+        self.next_id = len(self.documents) + 1
+        # One entry per write call: the method, the number of operations and the update operators used
+        self.writes: list[dict] = []
+
+    def find(self, filter: Optional[dict] = None, _projection: Optional[dict] = None) -> Iterator[dict]:
+        # Projections are ignored, the documents are copied so that callers cannot change them
+        return (copy.deepcopy(document) for document in self.documents if matches(document, filter or {}))
+
+    def find_one(self, filter: Optional[dict] = None) -> Optional[dict]:
+        return next(self.find(filter), None)
+
+    def bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        operators, results = Counter(), Counter()
+        for request in requests:
+            # pylint: disable=protected-access
+            operators.update(request._doc.keys())
+            results[self.update(request._filter, request._doc, request._upsert)] += 1
+
+        self.writes.append({"method": "bulk_write", "operations": len(requests), "ordered": ordered, "operators": dict(operators)})
+        # Every matched document counts as modified, even if the update changed nothing
+        return BulkWriteResult({"nMatched": results["matched"], "nModified": results["matched"], "nUpserted": results["upserted"],
+                                "nInserted": 0, "nRemoved": 0, "upserted": []}, True)
+
+    def update_many(self, filter: dict, update: dict | list):
+        count = 0
+        for document in self.documents:
+            if matches(document, filter):
+                if isinstance(update, dict):
+                    self.apply(document, update, False)
+                count += 1
+
+        operators = Counter(update.keys()) if isinstance(update, dict) else Counter(["pipeline"])
+        self.writes.append({"method": "update_many", "operations": count, "operators": dict(operators)})
+
+    def update(self, filter: dict, update: dict, upsert: bool) -> Optional[str]:
+        """
+        Returns whether a document was "matched" or "upserted".
+        """
+        document = next((document for document in self.documents if matches(document, filter)), None)
+        inserted = False
+        if document is None:
+            if not upsert:
+                return None
+
+            document = {"_id": self.next_id}
+            self.next_id += 1
+            for path, value in filter.items():
+                if "$" not in path:
+                    set_path(document, path, copy.deepcopy(value))
+            self.documents.append(document)
+            inserted = True
+
+        self.apply(document, update, inserted)
+        return "upserted" if inserted else "matched"
+
+    def apply(self, document: dict, update: dict, inserted: bool):
+        for operator, fields in update.items():
+            for path, value in fields.items():
+                if "$" in path:
+                    continue
+
+                if operator == "$set" or (operator == "$setOnInsert" and inserted):
+                    set_path(document, path, copy.deepcopy(value))
+                elif operator == "$addToSet":
+                    values = get_path(document, path)
+                    if values is MISSING:
+                        values = []
+                        set_path(document, path, values)
+                    for element in value["$each"] if isinstance(value, dict) and "$each" in value else [value]:
+                        if element not in values:
+                            values.append(copy.deepcopy(element))
+
+    def reset_writes(self):
+        self.writes = []
@@ -0,0 +1,101 @@
+"""
+Measure the local NameIndex against recorded Atlas $search results.
+
+Record the top-1 $search results for a sample of card names with one random typo each
+(needs an Atlas cluster with the "name_search" index):
+    python -m benchmarks.name_matching record --language ja --sample 2000 --output ja.jsonl
+
+Then compare the local index against the recording (throughput and agreement rate):
+    python -m benchmarks.name_matching compare --input ja.jsonl
+
+URI, DB_NAME and COLL_NAME are read from the environment or the .env file.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from dotenv import load_dotenv
+from pymongo.mongo_client import MongoClient
+
+from module.updaters.snapshot import CardSnapshot
+from module.utils.query import create_name_filter
+
+
+def open_snapshot() -> CardSnapshot:
+    load_dotenv()
+    coll = MongoClient(os.getenv("URI"))[os.getenv("DB_NAME")][os.getenv("COLL_NAME")]
+    return CardSnapshot(coll, ["bigweb", "yuyutei", "tcg_corner"])
+
+
+def with_typo(name: str, rng: random.Random) -> str:
+    if len(name) < 4 or rng.random() < 0.5:
+        return name
+
+    position = rng.randrange(len(name))
+    return name[:position] + name[position + 1:]
+
+
+def record(args: argparse.Namespace):
+    snapshot = open_snapshot()
+    rng = random.Random(args.seed)
+    cards = [card for card in snapshot.get_cards() if card["name"].get(args.language)]
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        for card in rng.sample(cards, min(args.sample, len(cards))):
+            query = with_typo(card["name"][args.language], rng)
+            result = next(snapshot.coll.aggregate([create_name_filter(args.language, query), {"$project": {"_id": 1}}]), None)
+            f.write(json.dumps({
+                "language": args.language,
+                "query": query,
+                "_id": str(result["_id"]) if result else None
+            }, ensure_ascii=False) + "\n")
+
+
+def compare(args: argparse.Namespace):
+    snapshot = open_snapshot()
+    with open(args.input, "r", encoding="utf-8") as f:
+        recorded = [json.loads(line) for line in f if line.strip()]
+
+    for language in sorted({entry["language"] for entry in recorded}):
+        entries = [entry for entry in recorded if entry["language"] == language]
+
+        start = time.perf_counter()
+        index = snapshot.get_name_index(language)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = [index.find(entry["query"]) for entry in entries]
+        match_time = time.perf_counter() - start
+
+        agreed = sum((str(card["_id"]) if card else None) == entry["_id"] for card, entry in zip(results, entries))
+
+        print(f"[{language}] {len(entries)} recorded queries")
+        print(f"  index build:      {build_time:.3f}s")
+        print(f"  throughput:       {len(entries) / match_time:.0f} queries/s")
+        print(f"  agreement:        {agreed / len(entries):.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("--language", choices=["ja", "en"], default="ja")
+    record_parser.add_argument("--sample", type=int, default=2000)
+    record_parser.add_argument("--seed", type=int, default=0)
+    record_parser.add_argument("--output", required=True)
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("--input", required=True)
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
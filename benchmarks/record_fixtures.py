@@ -0,0 +1,92 @@
+"""
+Record the pages used by the benchmark suite from the live sites into benchmarks/fixtures,
+through the same fetcher and headers as the scrapers (the cookies are read from the .env file).
+
+Usage: python -m benchmarks.record_fixtures [--yaml-yugi-cards 2000]
+
+This sends a few requests to each site, at the rates in HOST_RATE_LIMITS.
+"""
+import argparse
+import json
+import os
+
+import trio
+from dotenv import load_dotenv
+
+from module.scrapers.bigweb import BigwebScraper
+from module.scrapers.fetch import Fetcher
+from module.scrapers.tcg_corner import TCGCornerScraper, parse_page
+from module.scrapers.yaml_yugi import YAMLYugiScraper
+from module.scrapers.yugipedia import YugipediaScraper
+from module.scrapers.yuyutei import YuyuteiScraper
+from module.utils.json_stream import iter_json_array
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def write_fixture(name: str, text: str):
+    with open(os.path.join(FIXTURES, name), "w", encoding="utf-8") as f:
+        f.write(text)
+    print(f"Recorded {name}")
+
+
+async def record(fetcher: Fetcher, url: str, headers: dict, name: str) -> str:
+    if not (response := await fetcher.get_response(url, headers)):
+        raise RuntimeError(f"Could not fetch {url}")
+
+    write_fixture(name, response.text)
+    return response.text
+
+
+async def record_yaml_yugi(fetcher: Fetcher, count: int):
+    # Only the first cards of the aggregate are kept
+    scraper = YAMLYugiScraper(fetcher)
+    raw_cards = []
+    async with fetcher.open_stream(scraper.yaml_yugi_endpoint) as stream:
+        if not stream:
+            raise RuntimeError(f"Could not fetch {scraper.yaml_yugi_endpoint}")
+
+        async for raw_card in iter_json_array(stream[0]):
+            if len(raw_cards) < count:
+                raw_cards.append(raw_card)
+
+    write_fixture("yaml_yugi_cards.json", json.dumps(raw_cards, ensure_ascii=False))
+
+
+async def record_all(count: int):
+    fetcher = Fetcher()
+    try:
+        bigweb = BigwebScraper(fetcher)
+        yuyutei = YuyuteiScraper(fetcher)
+        yuyutei_kizu = YuyuteiScraper(fetcher, "kizu=1")
+        tcg_corner = TCGCornerScraper(fetcher)
+        yugipedia = YugipediaScraper(fetcher)
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(record, fetcher, bigweb.create_endpoint(1), bigweb.headers, "bigweb_page.json")
+            nursery.start_soon(record, fetcher, yuyutei.base_endpoint, yuyutei.headers, "yuyutei_page.html")
+            nursery.start_soon(record, fetcher, yuyutei_kizu.base_endpoint, yuyutei_kizu.headers, "yuyutei_kizu_page.html")
+            nursery.start_soon(record, fetcher, yugipedia.create_yugipedia_endpoint("Asian-English"), yugipedia.headers, "yugipedia_ask.json")
+            nursery.start_soon(record_yaml_yugi, fetcher, count)
+
+        html = await record(fetcher, tcg_corner.base_endpoint, tcg_corner.headers, "tcg_corner_page.html")
+        # A product page, for the rarities missing from the collection page
+        href = next((listing[-1] for listing in parse_page(html) or [] if listing[3] is None), None)
+        if href:
+            await record(fetcher, f"https://tcg-corner.com{href}", tcg_corner.headers | {"Referer": tcg_corner.base_endpoint},
+                         "tcg_corner_product.html")
+    finally:
+        await fetcher.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yaml-yugi-cards", type=int, default=2000, help="Number of YAML Yugi cards to keep")
+    args = parser.parse_args()
+
+    load_dotenv()
+    trio.run(record_all, args.yaml_yugi_cards)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare SetNumberIndex with the old generator scan used by
+CardPriceUpdater.find_card_with_set_number.
+
+Usage: python -m benchmarks.set_index [--cards 12000] [--prices 100000] [--scan-sample 2000]
+
+The generator scan is too slow to run against every price, so by default it is
+timed on a sample of the prices and extrapolated. Use --scan-sample 0 to scan them all.
+"""
+import argparse
+import random
+import time
+
+from module.utils.set_index import SetNumberIndex
+
+
+def generator_scan(cards: list, locale: str, set_number: str):
+    return next(
+        (card for card in cards for set in card["sets"][locale] if set["set_number"] in set_number), None)
+
+
+def make_cards(count: int, rng: random.Random) -> list[dict]:
+    set_codes = [f"{rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')}{rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')}"
+                 f"{rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')}{rng.randint(0, 99):02}" for _ in range(count // 20)]
+    cards = []
+    for konami_id in range(count):
+        sets = {"ja": [], "ae": []}
+        for _ in range(rng.randint(1, 5)):
+            code = rng.choice(set_codes)
+            number = rng.randint(1, 120)
+            sets["ja"].append({"set_number": f"{code}-JP{number:03}"})
+            sets["ae"].append({"set_number": f"{code}-AE{number:03}"})
+        cards.append({"_id": konami_id, "konami_id": konami_id, "sets": sets})
+
+    return cards
+
+
+def make_set_numbers(cards: list[dict], count: int, locale: str, rng: random.Random) -> list[str]:
+    set_numbers = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.7:
+            set_numbers.append(rng.choice(rng.choice(cards)["sets"][locale])["set_number"])
+        elif roll < 0.8:
+            set_numbers.append(rng.choice(rng.choice(cards)["sets"][locale])["set_number"] + " (Scratch)")
+        else:
+            set_numbers.append(f"ZZ{rng.randint(0, 99):02}-{locale.upper()}{rng.randint(1, 999):03}")
+
+    return set_numbers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=12000)
+    parser.add_argument("--prices", type=int, default=100000)
+    parser.add_argument("--scan-sample", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cards = make_cards(args.cards, rng)
+
+    for locale in ["ja", "ae"]:
+        set_numbers = make_set_numbers(cards, args.prices, locale, rng)
+
+        start = time.perf_counter()
+        index = SetNumberIndex(cards, locale)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        indexed = [index.find(set_number) for set_number in set_numbers]
+        index_time = time.perf_counter() - start
+
+        sample = set_numbers if args.scan_sample <= 0 else set_numbers[:args.scan_sample]
+        start = time.perf_counter()
+        scanned = [generator_scan(cards, locale, set_number) for set_number in sample]
+        scan_time = (time.perf_counter() - start) * len(set_numbers) / len(sample)
+
+        mismatches = sum(a is not b for a, b in zip(indexed, scanned))
+
+        print(f"[{locale}] {args.cards} cards, {args.prices} prices")
+        print(f"  index build:      {build_time:.3f}s")
+        print(f"  index lookups:    {index_time:.3f}s")
+        print(f"  generator scan:   {scan_time:.3f}s{' (extrapolated)' if len(sample) < len(set_numbers) else ''}")
+        print(f"  speedup:          {scan_time / (build_time + index_time):.0f}x")
+        print(f"  mismatches:       {mismatches}/{len(sample)}")
+
+
+if __name__ == "__main__":
+    main()
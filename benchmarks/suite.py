@@ -0,0 +1,244 @@
+"""
+Offline benchmarks of the scrapers and updaters over the recorded pages in benchmarks/fixtures,
+with FakeCollection standing in for MongoDB.
+
+Usage: python -m benchmarks.suite [--repeat 20] [--output results.json]
+
+Measures:
+  parse       pages and items parsed per second for every source
+  card_info   CardUpdater.add on an empty collection then on an up to date one, and its writes
+  matching    prices matched per second by CardPriceUpdater.add for every market, and its writes
+
+The results are printed (or written to --output) as JSON, so that runs can be compared
+for regression tracking. Run it from the repository root, the Bigweb scraper loads alias/rarity.json.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import time
+from typing import Any, Callable, Optional
+
+import trio
+
+from benchmarks.fake_collection import FakeCollection
+from module.scrapers import tcg_corner, yuyutei
+from module.scrapers.bigweb import BigwebScraper
+from module.scrapers.yaml_yugi import YAMLYugiScraper
+from module.scrapers.yugipedia import YugipediaScraper
+from module.updaters.card import CardUpdater
+from module.updaters.card_price import CardPriceUpdater
+from module.updaters.snapshot import CardSnapshot
+from module.utils.card import CardPrice, card_price_from_tuple, id_from_info
+from module.utils.config import Config, WriteConfig
+from module.utils.json_stream import iter_json_array
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+MARKETS = ["bigweb", "yuyutei", "tcg_corner"]
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def best_time(fn: Callable[..., Any], repeat: int, setup: Optional[Callable[[], Any]] = None) -> tuple[float, Any]:
+    """
+    Returns the fastest of "repeat" runs and the result of the last one.
+    "setup" runs before each of them and is not timed, its result is passed to "fn".
+    """
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def throughput(count: int, seconds: float) -> float:
+    return round(count / seconds, 1) if seconds else 0.0
+
+
+async def iter_chunks(data: bytes, chunk_size: int = 64 * 1024):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+
+def stream_yaml_yugi_cards(scraper: YAMLYugiScraper, data: bytes, batch_size: int = 1000) -> list:
+    async def stream():
+        cards, raw_cards = [], []
+        async for raw_card in iter_json_array(iter_chunks(data)):
+            raw_cards.append(raw_card)
+            if len(raw_cards) >= batch_size:
+                cards += scraper.parse_cards(raw_cards)
+                raw_cards = []
+
+        return cards + scraper.parse_cards(raw_cards)
+
+    return trio.run(stream)
+
+
+def create_tcg_corner_card_prices(listings: list, product_rarity: str) -> list[CardPrice]:
+    card_prices = []
+    for price, name, set_number, rarity, status, _ in listings:
+        rarity = rarity or product_rarity
+        card_prices.append(CardPrice(id=id_from_info(set_number + rarity), price=price, name=name, set_number=set_number,
+                                     rarity=rarity, condition="Good", status=status, last_modified=int(time.time())))
+
+    return card_prices
+
+
+def bench_parse(fixtures: dict, scrapers: dict, repeat: int) -> tuple[dict, dict]:
+    """
+    Returns the parse results, and what each source parsed to (used by the other benchmarks).
+    """
+    results, parsed = {}, {}
+
+    def record(source: str, pages: int, fn: Callable[[], list]):
+        seconds, items = best_time(fn, repeat)
+        parsed[source] = items
+        results[source] = {"pages": pages, "items": len(items), "seconds": round(seconds, 6),
+                           "pages_per_second": throughput(pages, seconds), "items_per_second": throughput(len(items), seconds)}
+
+    bigweb = scrapers["bigweb"]
+    record("bigweb", 1, lambda: [card_price for item in fixtures["bigweb"]["items"]
+                                 if (card_price := bigweb.parse_card_price(item))])
+    record("yuyutei", len(fixtures["yuyutei"]), lambda: [card_price for html in fixtures["yuyutei"]
+                                                         for card_price in yuyutei.parse_page(html, "Good")])
+    record("tcg_corner", 1, lambda: tcg_corner.parse_page(fixtures["tcg_corner"]))
+    record("tcg_corner_product", 1, lambda: [tcg_corner.parse_product_rarity(fixtures["tcg_corner_product"])])
+    record("yaml_yugi", 1, lambda: stream_yaml_yugi_cards(scrapers["yaml_yugi"], fixtures["yaml_yugi"]))
+    record("yugipedia", 1, lambda: scrapers["yugipedia"].parse_cards(fixtures["yugipedia"], "ae"))
+
+    return results, parsed
+
+
+def bench_card_info(cards: list, repeat: int) -> tuple[dict, FakeCollection]:
+    """
+    Returns the results, and the collection the cards were written to (used by the matching benchmark).
+    """
+    results = {}
+
+    def add(coll: FakeCollection) -> CardUpdater:
+        updater = CardUpdater(CardSnapshot(coll, MARKETS), WriteConfig(flush_size=len(cards) + 1))
+        updater.add(copy.deepcopy(cards))
+        return updater
+
+    seconds, updater = best_time(add, repeat, FakeCollection)
+    operations = len(updater.writer.operations)
+    updater.execute()
+    results["new"] = {"cards": len(cards), "seconds": round(seconds, 6), "cards_per_second": throughput(len(cards), seconds),
+                      "operations": operations, "writes": updater.coll.writes, "chunks": updater.writer.pop_summaries()}
+
+    coll = updater.coll
+    seconds, updater = best_time(add, repeat, lambda: FakeCollection(copy.deepcopy(coll.documents)))
+    operations = len(updater.writer.operations)
+    updater.execute()
+    results["unchanged"] = {"cards": len(cards), "seconds": round(seconds, 6), "cards_per_second": throughput(len(cards), seconds),
+                            "operations": operations, "writes": updater.coll.writes, "chunks": updater.writer.pop_summaries()}
+
+    return results, coll
+
+
+def bench_market(snapshot: CardSnapshot, market: str, prices: list[CardPrice], repeat: int) -> dict:
+    coll = snapshot.coll
+
+    def add(prices_copy: list) -> CardPriceUpdater:
+        updater = CardPriceUpdater(snapshot, market, Config(write=WriteConfig(flush_size=len(prices) + 1)))
+        updater.add(prices_copy)
+        return updater
+
+    def setup() -> list:
+        # The updater keeps the price map up to date with what it queues, every run starts from the snapshot
+        snapshot.price_maps.pop(market, None)
+        snapshot.get_price_map(market)
+        return copy.deepcopy(prices)
+
+    seconds, updater = best_time(add, repeat, setup)
+    # Duplicate prices that collapsed into no change leave None in place of their operation
+    operations = sum(operation is not None for operation in updater.writer.operations)
+    coll.reset_writes()
+    updater.execute()
+    return {"prices": len(prices), "seconds": round(seconds, 6), "prices_per_second": throughput(len(prices), seconds),
+            "operations": operations, "writes": coll.writes, "chunks": updater.writer.pop_summaries()}
+
+
+def bench_matching(coll: FakeCollection, card_prices: dict[str, list[CardPrice]], repeat: int) -> dict:
+    """
+    The prices are matched against cards without prices, then again once they have been written,
+    when they are all unchanged.
+    """
+    results = {}
+    snapshot = CardSnapshot(coll, MARKETS)
+
+    for run in ["new", "unchanged"]:
+        snapshot.invalidate()
+        start = time.perf_counter()
+        for locale in ["ja", "ae"]:
+            snapshot.get_set_index(locale)
+        for language in ["ja", "en"]:
+            snapshot.get_name_index(language)
+        results[run] = {"snapshot": {"cards": len(snapshot.get_cards()), "seconds": round(time.perf_counter() - start, 6)}}
+
+        for market in MARKETS:
+            results[run][market] = bench_market(snapshot, market, card_prices[market], repeat)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="Write the results to this file instead of printing them")
+    args = parser.parse_args()
+
+    # The scrapers read their cookies from the environment, but no request is sent here
+    for variable in ["USER_AGENT", "BIGWEB_API_COOKIE", "YUYUTEI_COOKIE", "TCG_CORNER_COOKIE"]:
+        os.environ.setdefault(variable, "")
+
+    fixtures = {
+        "bigweb": json.loads(read_fixture("bigweb_page.json")),
+        "yuyutei": [read_fixture("yuyutei_page.html"), read_fixture("yuyutei_kizu_page.html")],
+        "tcg_corner": read_fixture("tcg_corner_page.html"),
+        "tcg_corner_product": read_fixture("tcg_corner_product.html"),
+        "yaml_yugi": read_fixture("yaml_yugi_cards.json").encode(),
+        "yugipedia": json.loads(read_fixture("yugipedia_ask.json")),
+    }
+    scrapers = {
+        "bigweb": BigwebScraper(None),
+        "yaml_yugi": YAMLYugiScraper(None),
+        "yugipedia": YugipediaScraper(None),
+    }
+
+    parse_results, parsed = bench_parse(fixtures, scrapers, args.repeat)
+    card_info_results, coll = bench_card_info(parsed["yaml_yugi"] + parsed["yugipedia"], max(1, args.repeat // 4))
+
+    last_modified = int(time.time())
+    card_prices = {
+        "bigweb": parsed["bigweb"],
+        "yuyutei": [card_price_from_tuple(card_price, last_modified) for card_price in parsed["yuyutei"]],
+        "tcg_corner": create_tcg_corner_card_prices(parsed["tcg_corner"], parsed["tcg_corner_product"][0]),
+    }
+    matching_results = bench_matching(coll, card_prices, args.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "parse": parse_results,
+        "card_info": card_info_results,
+        "matching": matching_results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
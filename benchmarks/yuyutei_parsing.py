@@ -0,0 +1,80 @@
+"""
+Compare the single-pass Yuyutei extractor with the old extraction,
+which ran one selector per field for every card.
+
+Usage: python -m benchmarks.yuyutei_parsing [--repeat 50] [pages ...]
+
+By default the saved pages in benchmarks/fixtures are parsed.
+"""
+import argparse
+import glob
+import os
+import time
+from typing import Optional
+
+from selectolax.lexbor import LexborHTMLParser
+
+from module.scrapers.yuyutei import parse_page
+from module.utils.card import CardPriceTuple, id_from_info
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def selector_per_field_parse_page(html: str, condition: str) -> Optional[list[CardPriceTuple]]:
+    parser = LexborHTMLParser(html)
+    items = parser.css("div.py-4.cards-list")
+    if not items:
+        return None
+
+    card_prices = []
+    for item in items:
+        rarity_node = item.css_first("span.py-2.d-inline-block.px-2.me-2.text-white.fw-bold")
+        rarity = rarity_node.text() if rarity_node else ""
+        for card in item.css("div.card-product"):
+            try:
+                name = card.css_first("h4.text-primary.fw-bold").text()
+                price = int(card.css_first("strong[class^='d-block text-end']").text().split(" ")[0].replace(",", ""))
+                set_number = card.css_first("span.d-block.border.border-dark.p-1.w-100.text-center.my-2")
+                set_number = "Undefined" if not set_number or set_number.text() == "-" else set_number.text()
+
+                status = "Sold Out" if "sold-out" in card.attributes["class"] else "For Sale"
+                id = id_from_info((set_number + rarity + condition + name).replace(" ", ""))
+                card_prices.append((id, price, name, set_number, rarity, condition, status))
+            except AttributeError:
+                pass
+
+    return card_prices
+
+
+def measure(fn, pages: list[str], repeat: int) -> tuple[float, list]:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [fn(html, "Good") for html in pages]
+
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="*", default=sorted(glob.glob(os.path.join(FIXTURES, "yuyutei*.html"))))
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.pages:
+        with open(path, "r", encoding="utf-8") as f:
+            pages.append(f.read())
+
+    before_time, before = measure(selector_per_field_parse_page, pages, args.repeat)
+    after_time, after = measure(parse_page, pages, args.repeat)
+    cards = sum(len(card_prices) for card_prices in after) * args.repeat
+
+    print(f"{len(pages)} pages, {cards // args.repeat} cards, parsed {args.repeat} times")
+    print(f"  selector per field:  {cards / before_time:.0f} cards/s")
+    print(f"  single pass:         {cards / after_time:.0f} cards/s")
+    print(f"  speedup:             {before_time / after_time:.2f}x")
+    print(f"  identical results:   {before == after}")
+
+
+if __name__ == "__main__":
+    main()
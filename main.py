@@ -1,4 +1,5 @@
 import argparse
+import json
 import os
 import sys
 
@@ -6,9 +7,43 @@ import trio
 from dotenv import load_dotenv
 
 from module.executor import Executor
+from module.utils.config import Config, NameSearchConfig, WriteConfig
+from module.utils.metrics import metrics
 
 load_dotenv()
 
+"""
+The names of the markets, sources and daemon jobs on the command line, and in the Executor.
+"""
+MARKETS = {"bigweb": "Bigweb", "yuyutei": "Yuyutei", "tcg_corner": "TCG Corner"}
+SOURCES = {"yaml_yugi": "YAML Yugi", "yugipedia": "Yugipedia", "all": "All"}
+JOBS = {"card_info": "Card info", **MARKETS}
+DEFAULT_SCHEDULES = ["card_info=1d", "bigweb=1h", "yuyutei=1d", "tcg_corner=6h"]
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_interval(interval: str) -> float:
+    """
+    A number of seconds, or of minutes, hours or days with the "m", "h" or "d" suffix.
+    """
+    unit = INTERVAL_UNITS.get(interval[-1:], None)
+    try:
+        seconds = float(interval[:-1]) * unit if unit else float(interval)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid interval: {interval}") from e
+
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError(f"invalid interval: {interval}")
+    return seconds
+
+
+def parse_schedule(schedule: str) -> tuple[str, float]:
+    job, _, interval = schedule.partition("=")
+    if job not in JOBS:
+        raise argparse.ArgumentTypeError(f"invalid job: {job} (choose from {', '.join(JOBS)})")
+
+    return JOBS[job], parse_interval(interval)
+
 
 class CardManager:
     def __init__(self):
@@ -16,42 +51,141 @@ class CardManager:
         self.parser.add_argument("--init", action="store_true", help="Upsert card information and prices")
         self.parser.add_argument("--update-card-info", action="store_true", help="Upsert card information from YAML Yugi or Yugipedia")
         self.parser.add_argument("--update-card-prices", action="store_true", help="Upsert card prices from selected market")
+        self.parser.add_argument("--daemon", action="store_true",
+                                 help="Keep running and update the card information and prices of every market on a schedule")
+        self.parser.add_argument("--schedule", type=parse_schedule, action="append",
+                                 help="JOB=INTERVAL for --daemon, where JOB is card_info or a market and INTERVAL is in seconds "
+                                 f"or ends with m, h or d. Can be repeated, defaults to {' '.join(DEFAULT_SCHEDULES)}")
+        self.parser.add_argument("--markets", nargs="+", choices=[*MARKETS, "all"],
+                                 help="Markets updated by --update-card-prices instead of asking, and by --daemon with the default schedules")
+        self.parser.add_argument("--source", choices=SOURCES, help="Source of --update-card-info and of the card_info job, instead of asking")
+        self.parser.add_argument("--uri", default=os.getenv("URI"), help="MongoDB URI, URI in the environment or .env file by default")
+        self.parser.add_argument("--db-name", default=os.getenv("DB_NAME"), help="MongoDB database name, DB_NAME by default")
+        self.parser.add_argument("--coll-name", default=os.getenv("COLL_NAME"), help="MongoDB collection name, COLL_NAME by default")
+        self.parser.add_argument("--check-indexes", action="store_true",
+                                 help="Create the missing indexes, then print the unused ones and the plan of every updater query")
+        self.parser.add_argument("--name-search", choices=["local", "atlas", "atlas-batch"], default="local",
+                                 help="Match card prices by name locally, or with the Atlas Search 'name_search' index one price (atlas) "
+                                 "or one batch of prices (atlas-batch) per aggregate")
+        self.parser.add_argument("--name-batch-size", type=int, default=50, help="Number of names per aggregate with atlas-batch")
+        self.parser.add_argument("--name-batch-concurrency", type=int, default=4, help="Number of concurrent aggregates with atlas-batch")
+        self.parser.add_argument("--resume", action="store_true", help="Continue scraping card prices from the last checkpoint")
+        self.parser.add_argument("--flush-size", type=int, default=1000, help="Write cards and card prices every N operations while scraping")
+        self.parser.add_argument("--flush-in-background", action="store_true",
+                                 help="Write the operations in one thread, in order, while scraping continues instead of in the updater")
+        self.parser.add_argument("--write-concern", help="Write concern of the bulk writes, a number of members or \"majority\"")
+        self.parser.add_argument("--sweep", choices=["mark", "prune", "off"], default="mark",
+                                 help="After a complete crawl, mark the prices of listings that are gone as \"Removed\", remove them, or keep them")
+        self.parser.add_argument("--price-history", action="store_true",
+                                 help="Also append every change of a card price to the <COLL_NAME>_history time-series collection")
+        self.parser.add_argument("--bigweb-concurrency", type=int, default=1, help="Number of Bigweb pages fetched at a time")
+        self.parser.add_argument("--bigweb-rps", type=float, help="Maximum number of requests per second sent to Bigweb")
+        self.parser.add_argument("--parse-workers", type=int, default=2,
+                                 help="Number of processes parsing Yuyutei and TCG Corner pages, 0 parses them in a thread")
+        self.parser.add_argument("--metrics-report", help="Write the timings and counters of the run to this JSON file")
+        self.parser.add_argument("--metrics-prometheus", help="Write the timings and counters of the run to this file in the Prometheus text format")
         self.args = self.parser.parse_args()
         self.executor = None
 
-        self.markets = ["Bigweb", "Yuyutei", "TCG Corner"]
+        self.markets = list(MARKETS.values())
 
     def setup_executor(self):
-        print("Setup MongoDB...")
-        print(
-            """Tips: To avoid having to enter the URI, DB_NAME, and COLL_NAME again,
+        uri, db_name, coll_name = self.args.uri, self.args.db_name, self.args.coll_name
+        if not (uri and db_name and coll_name):
+            # Without a terminal (cron, systemd...) there is no one to ask
+            if not sys.stdin.isatty():
+                self.parser.error("--uri, --db-name and --coll-name (or URI, DB_NAME and COLL_NAME) are required")
+
+            print("Setup MongoDB...")
+            print(
+                """Tips: To avoid having to enter the URI, DB_NAME, and COLL_NAME again,
 			you can add them to the .env file."""
+            )
+            uri = uri or input("Enter your MongoDB URI: ")
+            db_name = db_name or input(
+                "Enter your MongoDB Database name: ")
+            coll_name = coll_name or input(
+                "Enter your MongoDB Collection name: ")
+
+        config = Config(
+            name_search=NameSearchConfig(self.args.name_search, self.args.name_batch_size, self.args.name_batch_concurrency),
+            write=WriteConfig(self.args.flush_size, self.args.flush_in_background, self.args.write_concern),
+            bigweb_concurrency=self.args.bigweb_concurrency,
+            bigweb_rate=self.args.bigweb_rps,
+            parse_workers=self.args.parse_workers,
+            sweep=self.args.sweep,
+            price_history=self.args.price_history
         )
-        uri = os.getenv("URI") or input("Enter your MongoDB URI: ")
-        db_name = os.getenv("DB_NAME") or input(
-            "Enter your MongoDB Database name: ")
-        coll_name = os.getenv("COLL_NAME") or input(
-            "Enter your MongoDB Collection name: ")
-
-        self.executor = Executor(uri, db_name, coll_name)
+        self.executor = Executor(uri, db_name, coll_name, config)
 
     def update_card_info(self):
-        source = self.get_user_choice(
-            "Card information", ["YAML Yugi", "Yugipedia", "All"])
+        if self.args.source:
+            source = SOURCES[self.args.source]
+        else:
+            source = self.get_user_choice(
+                "Card information", ["YAML Yugi", "Yugipedia", "All"])
         print(f"Updating card information from {source}...")
-        self.executor.update_cards(source)
+        self.run(self.executor.update_cards, source)
 
     def update_card_prices(self):
-        source = self.get_user_choice("Card prices", self.markets + ["All"])
-        if source == "All":
-            markets_to_update = self.markets
+        if self.args.markets:
+            markets_to_update = self.markets if "all" in self.args.markets else [MARKETS[market] for market in self.args.markets]
         else:
-            markets_to_update = [source]
+            source = self.get_user_choice("Card prices", self.markets + ["All"])
+            if source == "All":
+                markets_to_update = self.markets
+            else:
+                markets_to_update = [source]
 
         print(f"Updating prices from {', '.join(markets_to_update)}...")
-        trio.run(self.executor.update_prices, markets_to_update)
+        self.run(self.executor.update_prices, markets_to_update, self.args.resume)
+
+    def run_daemon(self):
+        schedules = dict(self.args.schedule or [parse_schedule(schedule) for schedule in DEFAULT_SCHEDULES])
+        # --markets picks the markets of the default schedules, --schedule lists its jobs itself
+        if self.args.markets and "all" not in self.args.markets and not self.args.schedule:
+            selected = [MARKETS[market] for market in self.args.markets]
+            schedules = {job: interval for job, interval in schedules.items() if job not in self.markets or job in selected}
+        print(f"Running {', '.join(f'{job} every {interval:.0f}s' for job, interval in schedules.items())}...")
+        # The metrics are written after every job, as the daemon only stops when it is interrupted
+        self.run(self.executor.run_daemon, schedules, SOURCES[self.args.source or "all"], self.args.resume, self.write_metrics)
+
+    def check_indexes(self):
+        async def check_and_print():
+            print(json.dumps(await self.executor.check_indexes(), indent=4))
+
+        self.run(check_and_print)
+
+    def initialize(self):
+        self.run(self.executor.initialize, self.markets, self.args.resume)
+
+    def run(self, async_fn, *args):
+        """
+        Everything runs in a single trio.run, as the fetcher's connection pool
+        is bound to the event loop it is first used in.
+        """
+        async def run_and_close():
+            try:
+                await async_fn(*args)
+            finally:
+                await self.executor.close()
+
+        try:
+            trio.run(run_and_close)
+        finally:
+            self.write_metrics()
+
+    def write_metrics(self):
+        # Also written when the run is interrupted, to see where the time went until then
+        if self.args.metrics_report:
+            metrics.write_report(self.args.metrics_report)
+        if self.args.metrics_prometheus:
+            metrics.write_prometheus(self.args.metrics_prometheus)
 
     def get_user_choice(self, update_type: str, sources: list[str]):
+        if not sys.stdin.isatty():
+            self.parser.error(f"--source or --markets is required to choose the {update_type.lower()} without a terminal")
+
         while True:
             self.print_menu(update_type, sources)
             choice = input("Enter your selection: ")
@@ -77,14 +211,17 @@ class CardManager:
 if __name__ == "__main__":
     manager = CardManager()
     manager.setup_executor()
-    if manager.args.init:
+    if manager.args.daemon:
+        manager.run_daemon()
+    elif manager.args.init:
         print("Initializing...")
-        manager.executor.update_cards("All")
-        trio.run(manager.executor.update_prices, manager.markets)
+        manager.initialize()
     elif manager.args.update_card_info:
         manager.update_card_info()
     elif manager.args.update_card_prices:
         manager.update_card_prices()
+    elif manager.args.check_indexes:
+        manager.check_indexes()
     else:
         print("No action specified. Use --help to see available options.")
         sys.exit(1)
@@ -1,68 +1,278 @@
+import math
+from contextlib import AsyncExitStack
+from functools import partial
+from typing import Callable, Optional
+
 from pymongo.collection import Collection
 from pymongo.mongo_client import MongoClient
-from trio import open_nursery
+from trio import (Event, Lock, current_time, open_memory_channel, open_nursery,
+                  sleep_until)
 from trio.to_thread import run_sync
 
 from .scrapers.bigweb import BigwebScraper
+from .scrapers.fetch import Fetcher, HTTPCache
 from .scrapers.tcg_corner import TCGCornerScraper
 from .scrapers.yaml_yugi import YAMLYugiScraper
 from .scrapers.yugipedia import YugipediaScraper
 from .scrapers.yuyutei import YuyuteiScraper
 from .updaters.card import CardUpdater
 from .updaters.card_price import CardPriceUpdater
-from .utils.card import Card
+from .updaters.price_history import PriceHistory
+from .updaters.snapshot import CardSnapshot
+from .utils.card import MARKETS, Card
+from .utils.checkpoint import CheckpointStore
+from .utils.config import Config
+from .utils.indexes import ensure_indexes, explain_queries, report_indexes
+from .utils.logger import setup_logger
+from .utils.metrics import metrics
+from .utils.parse_pool import ParsePool
+from .utils.price_query import fill_price_summaries
+from .utils.rarity_cache import RarityCache
+
+logger = setup_logger("executor", "logs/executor.log")
+
+# The Yugipedia pages scraped ahead while YAML Yugi is being added, the queries wait for room after that
+YUGIPEDIA_BUFFERED_PAGES = 4
 
 
 class Executor:
-    def __init__(self, uri: str, db: str, coll: str):
+    def __init__(self, uri: str, db: str, coll: str, config: Optional[Config] = None):
+        self.config = config or Config()
         self.client = MongoClient(uri)
         self.db = self.client[db]
         self.coll: Collection[Card] = self.db[coll]
 
+        self.fetcher = Fetcher(cache=HTTPCache())
+        if self.config.bigweb_rate:
+            self.fetcher.set_rate_limit("api.bigweb.co.jp", self.config.bigweb_rate)
+
         self.info_scrapers = {
-            "YAML Yugi": YAMLYugiScraper(),
-            "Yugipedia": YugipediaScraper(),
+            # An unchanged page of a source is skipped once its cards have been written to this collection
+            "YAML Yugi": YAMLYugiScraper(self.fetcher, f"{db}.{coll}"),
+            "Yugipedia": YugipediaScraper(self.fetcher, f"{db}.{coll}"),
         }
 
+        self.parse_pool = ParsePool(self.config.parse_workers)
         self.prices_scrapers = {
-            "Bigweb": [BigwebScraper()],
-            "Yuyutei": [YuyuteiScraper(), YuyuteiScraper("kizu=1")],
-            "TCG Corner": [TCGCornerScraper()]
+            "Bigweb": [BigwebScraper(self.fetcher, self.config.bigweb_concurrency)],
+            "Yuyutei": [YuyuteiScraper(self.fetcher, parse_pool=self.parse_pool), YuyuteiScraper(self.fetcher, "kizu=1", self.parse_pool)],
+            "TCG Corner": [TCGCornerScraper(self.fetcher, RarityCache(), self.parse_pool)]
         }
 
+        self.snapshot = CardSnapshot(self.coll, MARKETS)
+        self.history = PriceHistory(self.db, f"{coll}_history", self.config.write) if self.config.price_history else None
+
         self.updaters = {
-            "Card info": CardUpdater(self.coll),
-            "TCG Corner": CardPriceUpdater(self.coll, "tcg_corner"),
-            "Bigweb": CardPriceUpdater(self.coll, "bigweb", True),
-            "Yuyutei": CardPriceUpdater(self.coll, "yuyutei", True)
+            "Card info": CardUpdater(self.snapshot, self.config.write),
+            "TCG Corner": CardPriceUpdater(self.snapshot, "tcg_corner", self.config, self.history),
+            "Bigweb": CardPriceUpdater(self.snapshot, "bigweb", self.config, self.history),
+            "Yuyutei": CardPriceUpdater(self.snapshot, "yuyutei", self.config, self.history)
         }
 
-    def update_cards(self, source: str):
-        cards: list[Card] = []
-        if source == "YAML Yugi":
-            cards += self.info_scrapers[source].scrape()
-        elif source == "Yugipedia":
-            cards += self.info_scrapers[source].scrape_all()
-        elif source == "All":
-            cards += self.info_scrapers["YAML Yugi"].scrape()
-            cards += self.info_scrapers["Yugipedia"].scrape_all()
+        self.checkpoints = CheckpointStore()
+        self.collection_ready = False
+
+    async def prepare_collection(self):
+        """
+        Before the first update: creates the missing indexes, reports the unused ones
+        and computes the missing price summaries.
+        """
+        if self.collection_ready:
+            return
+
+        created = await run_sync(ensure_indexes, self.coll)
+        await run_sync(report_indexes, self.coll, created)
+        await run_sync(fill_price_summaries, self.coll)
+        self.collection_ready = True
+
+    async def check_indexes(self) -> dict:
+        """
+        Creates the missing indexes, then reports the indexes and how every updater query is planned.
+        """
+        created = await run_sync(ensure_indexes, self.coll)
+        return {"indexes": await run_sync(report_indexes, self.coll, created), "queries": await run_sync(explain_queries, self.coll)}
+
+    async def update_cards(self, source: str, force: bool = False):
+        """
+        Both sources are added batch by batch while they are scraped. Yugipedia pages are held
+        until YAML Yugi is done, so that they are added after it as the sources used to be merged,
+        and only a few of them are scraped ahead, so they are not all held in memory.
+        """
+        await self.prepare_collection()
+        updater = self.updaters["Card info"]
+        yaml_yugi_done = Event()
+        send_channel, receive_channel = open_memory_channel(YUGIPEDIA_BUFFERED_PAGES)
+
+        async def add_yaml_yugi():
+            try:
+                async for cards, on_written in self.info_scrapers["YAML Yugi"].scrape(force):
+                    await run_sync(updater.add, cards, on_written)
+            finally:
+                yaml_yugi_done.set()
 
-        self.updaters["Card info"].add(cards)
-        self.updaters["Card info"].execute()
+        async def add_yugipedia():
+            await yaml_yugi_done.wait()
+            async with receive_channel:
+                async for cards, on_written in receive_channel:
+                    await run_sync(updater.add, cards, on_written)
 
-    async def update_prices(self, markets: list[str]):
+        async with open_nursery() as nursery:
+            if source in ["YAML Yugi", "All"]:
+                nursery.start_soon(add_yaml_yugi)
+            else:
+                yaml_yugi_done.set()
+            if source in ["Yugipedia", "All"]:
+                nursery.start_soon(self.info_scrapers["Yugipedia"].scrape_all, send_channel, force)
+                nursery.start_soon(add_yugipedia)
+
+        await run_sync(updater.execute)
+
+    async def initialize(self, markets: list[str], resume: bool = False):
+        """
+        A full refresh of the card information, even if it has not changed since it was last cached,
+        while the prices are crawled. The price pages are held until the card information
+        has been written, then matched against the reloaded snapshot.
+        """
+        await self.prepare_collection()
+        cards_ready = Event()
+
+        async def update_cards():
+            await self.update_cards("All", True)
+            cards_ready.set()
+
+        async with open_nursery() as nursery:
+            nursery.start_soon(update_cards)
+            nursery.start_soon(self.update_prices, markets, resume, cards_ready)
+
+    async def update_prices(self, markets: list[str], resume: bool = False, cards_ready: Optional[Event] = None):
+        await self.prepare_collection()
         async with open_nursery() as nursery:
             for market in markets:
                 if market in self.prices_scrapers and market in self.updaters:
-                    for scraper in self.prices_scrapers[market]:
-                        nursery.start_soon(
-                            run_sync,
-                            self.task,
-                            scraper,
-                            self.updaters[market]
-                        )
-
-    def task(self, scraper, updater):
-        prices = scraper.scrape()
-        updater.add(prices)
-        updater.execute()
+                    nursery.start_soon(self.update_market, market, resume, cards_ready)
+
+    async def run_daemon(self, schedules: dict[str, float], source: str = "All", resume: bool = False,
+                         after_job: Optional[Callable[[], None]] = None):
+        """
+        Runs every job of "schedules", "Card info" or a market, every given number of seconds until cancelled,
+        with the same MongoClient, fetcher connections and snapshot. A job that is late skips the runs it missed,
+        and a job that fails is logged and run again at its next time.
+        The card information is only updated while no prices are, as it reloads the snapshot they are matched against,
+        and so is the snapshot reloaded after a job fails, as it holds the prices of the writes that did not land.
+        """
+        market_locks = {job: Lock() for job in schedules if job in self.prices_scrapers}
+
+        async def lock_all_markets(stack: AsyncExitStack):
+            for lock in market_locks.values():
+                await stack.enter_async_context(lock)
+
+        async def run_job(job: str, resume: bool):
+            if job == "Card info":
+                async with AsyncExitStack() as stack:
+                    await lock_all_markets(stack)
+                    await self.update_cards(source)
+            else:
+                async with market_locks[job]:
+                    await self.update_prices([job], resume)
+
+        async def reset_job(job: str):
+            async with AsyncExitStack() as stack:
+                await lock_all_markets(stack)
+                await run_sync(self.reset, job)
+
+        async def schedule(job: str, interval: float):
+            next_run, job_resume = current_time(), resume
+            while True:
+                logger.info(f"Running {job}")
+                try:
+                    await run_job(job, job_resume)
+                except Exception as e:
+                    logger.error(f"{job} failed: {e!r}")
+                    await reset_job(job)
+                # Only the first run continues from the checkpoints
+                job_resume = False
+                if after_job:
+                    after_job()
+
+                while next_run <= current_time():
+                    next_run += interval
+                logger.info(f"Next run of {job} in {next_run - current_time():.0f}s")
+                await sleep_until(next_run)
+
+        await self.prepare_collection()
+        async with open_nursery() as nursery:
+            for job, interval in schedules.items():
+                nursery.start_soon(schedule, job, interval)
+
+    def reset(self, job: str):
+        """
+        Drops what a failed job left in its updater, and the snapshot with its price maps,
+        which already hold the prices of the operations that were not written.
+        """
+        self.updaters[job].reset()
+        self.snapshot.invalidate()
+
+    async def update_market(self, market: str, resume: bool = False, cards_ready: Optional[Event] = None):
+        """
+        Runs every scraper of the market, then sweeps the listings that are gone
+        if all of them crawled every page from the first one.
+        """
+        updater = self.updaters[market]
+        complete = []
+
+        async def run_task(scraper):
+            complete.append(await self.task(scraper, updater, resume, cards_ready))
+
+        async with open_nursery() as nursery:
+            for scraper in self.prices_scrapers[market]:
+                nursery.start_soon(run_task, scraper)
+
+        await run_sync(updater.sweep, self.config.sweep, all(complete))
+
+    async def task(self, scraper, updater, resume: bool = False, cards_ready: Optional[Event] = None) -> bool:
+        """
+        Returns whether the scraper crawled every page, starting from the first one.
+        With "cards_ready", the pages are held until it is set, while the scraper keeps crawling.
+        """
+        resumed = False
+        if resume and (state := self.checkpoints.load(scraper.checkpoint_key)):
+            scraper.restore(state)
+            resumed = True
+        else:
+            scraper.reset()
+
+        # Matching and writing block, so they run in a worker thread while the scraper fetches the next page.
+        # A checkpoint is only saved once the pages before it have been written.
+        send_channel, receive_channel = open_memory_channel(math.inf if cards_ready else 0)
+
+        async def add_pages():
+            if cards_ready:
+                await cards_ready.wait()
+            async with receive_channel:
+                async for card_prices, save_checkpoint in receive_channel:
+                    await run_sync(updater.add, card_prices, save_checkpoint)
+
+        with metrics.timer("scrape_seconds", scraper=scraper.checkpoint_key):
+            async with open_nursery() as nursery:
+                nursery.start_soon(add_pages)
+                async with send_channel:
+                    async for card_prices in scraper.scrape():
+                        metrics.inc("scrape_pages", scraper=scraper.checkpoint_key)
+                        save_checkpoint = partial(self.checkpoints.save, scraper.checkpoint_key, scraper.get_state())
+                        await send_channel.send((card_prices, save_checkpoint))
+            await run_sync(updater.execute)
+
+        if scraper.complete:
+            self.checkpoints.clear(scraper.checkpoint_key)
+        else:
+            self.checkpoints.save(scraper.checkpoint_key, scraper.get_state())
+
+        return scraper.complete and not resumed
+
+    async def close(self):
+        await self.fetcher.aclose()
+        for updater in self.updaters.values():
+            await run_sync(updater.writer.close)
+        if self.history:
+            await run_sync(self.history.writer.close)
+        await run_sync(self.parse_pool.shutdown)
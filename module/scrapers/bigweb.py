@@ -1,58 +1,97 @@
 import json
 import os
-import random
 import time
-from typing import Optional
+from typing import AsyncIterator, Optional
 
-import requests
+from trio import open_nursery
 
 from ..utils.card import CardPrice
 from ..utils.logger import setup_logger
 from ..utils.string_manip import half_to_full
-from .fetch import get_response
+from .fetch import Fetcher
 
 logger = setup_logger("Bigweb scraper", "logs/bigweb_scraper.log")
 
 
 class BigwebScraper:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
+    def __init__(self, fetcher: Fetcher, concurrency: int = 1):
+        self.fetcher = fetcher
+        # Number of pages fetched at a time once the page count is known,
+        # the requests per second are still limited by the fetcher.
+        self.concurrency = max(1, concurrency)
+        self.headers = {
             "User-Agent": os.getenv("USER_AGENT"),
             "Cookie": os.getenv("BIGWEB_API_COOKIE").replace("\n", "").strip(),
             # pylint: disable=line-too-long
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9.image/avif,jimage/webpimage/apng*/*;q=0.8,application/signed exchange:v-b3;q-0.7",
             "Accept-Language": "vi-VN,vi;q=0.9,fr-FR;q=0.8,fr;q=0.7,en-US;q=0.6,en;q=0.5",
-        })
+        }
 
         self.rarity_alias = self.load_rarity_alias()
 
-    def scrape(self) -> list[CardPrice]:
-        card_prices = []
-        page = 1
-        while True:
-            url = f"https://api.bigweb.co.jp/products?game_id=9&page={page}"
-            response = get_response(self.session.get, url)
-            if not response:
-                break
-
-            data = response.json()
-            raw_cards = data["items"]
-            if len(raw_cards) == 0:
-                break
-
-            for raw_card in raw_cards:
-                card_price = self.parse_card_price(raw_card)
-                if card_price:
-                    card_prices.append(card_price)
-            if page >= int(data["pagenate"]["pageCount"]):
-                break
-
-            time.sleep(random.randint(5, 6))
-            logger.info(f"Bigweb - Completed scraping page number: {page}")
-            page += 1
-
-        return card_prices
+        self.checkpoint_key = "bigweb"
+        self.page = 1
+        self.complete = False
+
+    def reset(self):
+        self.page = 1
+        self.complete = False
+
+    def get_state(self) -> dict:
+        return {"page": self.page, "url": self.create_endpoint(self.page)}
+
+    def restore(self, state: dict):
+        self.page = state["page"]
+        self.complete = False
+
+    def create_endpoint(self, page: int) -> str:
+        return f"https://api.bigweb.co.jp/products?game_id=9&page={page}"
+
+    async def scrape(self) -> AsyncIterator[list[CardPrice]]:
+        page_count = None
+        while page_count is None or self.page <= page_count:
+            if page_count is None:
+                pages = [self.page]
+            else:
+                pages = list(range(self.page, min(self.page + self.concurrency, page_count + 1)))
+
+            for data in await self.fetch_pages(pages):
+                if data is None:
+                    return
+
+                if len(data["items"]) == 0:
+                    self.complete = True
+                    return
+
+                page_count = int(data["pagenate"]["pageCount"])
+                card_prices = []
+                for raw_card in data["items"]:
+                    card_price = self.parse_card_price(raw_card)
+                    if card_price:
+                        card_prices.append(card_price)
+
+                self.page += 1
+                yield card_prices
+
+                logger.info(f"Bigweb - Completed scraping page number: {self.page - 1}")
+
+        self.complete = True
+
+    async def fetch_pages(self, pages: list[int]) -> list[Optional[dict]]:
+        """
+        Returns the pages in the order they were asked for, None for the ones that could not be fetched.
+        """
+        results = [None] * len(pages)
+
+        async def fetch(i: int, page: int):
+            if (response := await self.fetcher.get_response(self.create_endpoint(page), self.headers)):
+                results[i] = response.json()
+
+        async with open_nursery() as nursery:
+            for i, page in enumerate(pages):
+                nursery.start_soon(fetch, i, page)
+
+        return results
 
     def parse_card_price(self, raw_card_price: dict) -> Optional[CardPrice]:
         """
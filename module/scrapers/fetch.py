@@ -1,29 +1,332 @@
-from time import sleep
-from typing import Callable, Optional
+import hashlib
+import json
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from time import monotonic
+from typing import AsyncIterator, Optional
+from urllib.parse import urlsplit
 
-from requests import Response
-from requests.exceptions import (ConnectionError, HTTPError, RequestException,
-                                 Timeout)
+import httpx
+import trio
 
+from ..utils.logger import setup_logger
+from ..utils.metrics import metrics
+
+logger = setup_logger("fetch", "logs/fetch.log")
+
+"""
+Requests per second, burst size and jitter (up to that many seconds added at random to a wait) allowed
+for each host, or for the URLs of a host under a path ("host/path"), shared by every scraper using it.
+A request waits for the limiter of its host, and for the one of its path if there is one.
+Yuyutei is scraped by two scrapers (with and without "kizu=1"), which used to wait 20 to 25 seconds
+between pages each. TCG Corner prohibits scraping, so it keeps the delays it used to have:
+20 to 25 seconds between listing pages and 10 to 15 seconds before any other request,
+as it also fetches product pages to find missing rarities.
+"""
+HOST_RATE_LIMITS = {
+    "api.bigweb.co.jp": (1 / 5.5, 1),
+    "yuyu-tei.jp": (1 / 11, 1),
+    "tcg-corner.com": (1 / 10, 1, 5),
+    "tcg-corner.com/collections/": (1 / 20, 1, 5),
+    "yugipedia.com": (1 / 2, 1),
+    "raw.githubusercontent.com": (1, 1),
+}
+
+"""
+Endpoints (URL prefixes) whose responses are cached on disk, with the number of seconds
+a cached response is used without asking the server again. After that it is revalidated
+with If-None-Match / If-Modified-Since, and a 304 costs one round trip instead of a download.
+"""
+CACHE_MAX_AGES = {
+    "https://raw.githubusercontent.com/DawnbrandBots/yaml-yugi/": 60 * 60,
+    "https://yugipedia.com/api.php": 60 * 60,
+}
+
+
+class RateLimiter:  # pylint: disable=too-few-public-methods
+    """
+    A token bucket: "rate" tokens are added per second up to "burst" tokens,
+    and every request takes one, waiting for it, and up to "jitter" more seconds, if the bucket is empty.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, jitter: float = 0):
+        self.rate = rate
+        self.burst = burst
+        self.jitter = jitter
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.lock = trio.Lock()
+
+    async def acquire(self):
+        # Waiting while holding the lock keeps the requests of a host in arrival order
+        async with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens < 1:
+                await trio.sleep((1 - self.tokens) / self.rate + random.uniform(0, self.jitter))
+                self.tokens = 1
+                self.updated = monotonic()
+
+            self.tokens -= 1
+
+
+class HTTPCache:
+    """
+    Every cached response is stored as two files named after the hash of its URL:
+    the body, and its validators (ETag, Last-Modified) with the time it was stored
+    and the consumers (the collections) that have written the data of this body.
+    """
+
+    def __init__(self, directory: str = "http_cache", max_ages: Optional[dict[str, int]] = None):
+        self.directory = directory
+        self.max_ages = CACHE_MAX_AGES if max_ages is None else max_ages
+        os.makedirs(directory, exist_ok=True)
+
+    def max_age(self, url: str) -> Optional[int]:
+        return next((max_age for prefix, max_age in self.max_ages.items() if url.startswith(prefix)), None)
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def load_meta(self, url: str) -> Optional[dict]:
+        try:
+            with open(f"{self.path(url)}.json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def load_body(self, url: str) -> bytes:
+        with open(f"{self.path(url)}.body", "rb") as f:
+            return f.read()
+
+    async def iter_body(self, url: str, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        with open(f"{self.path(url)}.body", "rb") as f:
+            while (chunk := f.read(chunk_size)):
+                yield chunk
+
+    def store(self, url: str, response: httpx.Response):
+        with open(f"{self.path(url)}.body.tmp", "wb") as f:
+            f.write(response.content)
+        os.replace(f"{self.path(url)}.body.tmp", f"{self.path(url)}.body")
+        self.store_meta(url, self.create_meta(response))
+
+    async def iter_and_store(self, url: str, response: httpx.Response) -> AsyncIterator[bytes]:
+        """
+        Writes a streamed body to the cache as it is read,
+        the entry is only replaced once the whole body has been read.
+        """
+        with open(f"{self.path(url)}.body.tmp", "wb") as f:
+            async for chunk in response.aiter_bytes():
+                f.write(chunk)
+                yield chunk
+        os.replace(f"{self.path(url)}.body.tmp", f"{self.path(url)}.body")
+        self.store_meta(url, self.create_meta(response))
+
+    def create_meta(self, response: httpx.Response) -> dict:
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get("Content-Type"),
+            "stored": time.time(),
+            "consumers": []
+        }
+
+    def store_meta(self, url: str, meta: dict):
+        with open(f"{self.path(url)}.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(f"{self.path(url)}.json.tmp", f"{self.path(url)}.json")
+
+    def mark_consumed(self, url: str, consumer: str):
+        """
+        Called once the data of the cached body has been written, a crash or a failed write before that
+        leaves the body to be parsed again by the next run, even though it has not changed.
+        """
+        if (meta := self.load_meta(url)) and consumer not in meta.setdefault("consumers", []):
+            meta["consumers"].append(consumer)
+            self.store_meta(url, meta)
+
+    def conditional_headers(self, meta: dict) -> dict:
+        headers = {}
+        if meta["etag"]:
+            headers["If-None-Match"] = meta["etag"]
+        if meta["last_modified"]:
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        return headers
+
+    def to_response(self, url: str, meta: dict, consumer: Optional[str] = None) -> httpx.Response:
+        """
+        The "not_modified" extension tells the scrapers that the data of this response
+        has already been written by "consumer" and that they can skip it.
+        """
+        headers = {"Content-Type": meta["content_type"]} if meta["content_type"] else {}
+        return httpx.Response(200, headers=headers, content=self.load_body(url), request=httpx.Request("GET", url),
+                              extensions={"not_modified": is_consumed(meta, consumer)})
+
+
+def is_consumed(meta: dict, consumer: Optional[str]) -> bool:
+    return consumer is not None and consumer in meta.get("consumers", [])
+
+
+def is_not_modified(response: httpx.Response) -> bool:
+    return response.extensions.get("not_modified", False)
+
+
+@dataclass
+class Retries:
+    """
+    Up to "attempts" attempts, the next one after a random delay (full jitter)
+    of at most "backoff_base" * 2 ** attempt, capped at "backoff_cap" seconds.
+    """
+    attempts: int = 10
+    backoff_base: float = 1
+    backoff_cap: float = 60
+
+
+class Fetcher:
+    """
+    One connection pool shared by every scraper, with a rate limiter per host
+    and retries with exponential backoff and full jitter.
+    """
+
+    def __init__(self, rate_limits: Optional[dict[str, tuple]] = None, retries: Optional[Retries] = None, cache: Optional[HTTPCache] = None):
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30),
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+        self.limiters = {prefix: RateLimiter(*limit) for prefix, limit in (HOST_RATE_LIMITS if rate_limits is None else rate_limits).items()}
+        self.retries = retries or Retries()
+        self.cache = cache
+
+    def set_rate_limit(self, host: str, rate: float, burst: int = 1):
+        self.limiters[host] = RateLimiter(rate, burst)
+
+    def find_limiters(self, url: str) -> list[RateLimiter]:
+        """
+        The limiters of the host of "url" and of its path, the path one first
+        as it waits longer than the host one.
+        """
+        parts = urlsplit(url)
+        location = f"{parts.hostname}{parts.path}"
+        limiters = [limiter for prefix, limiter in self.limiters.items() if "/" in prefix and location.startswith(prefix)]
+        if parts.hostname in self.limiters:
+            limiters.append(self.limiters[parts.hostname])
+        return limiters
+
+    async def get_response(self, url: str, headers: Optional[dict] = None, consumer: Optional[str] = None) -> Optional[httpx.Response]:
+        """
+        A cached response is "not_modified" if it has not changed since "consumer" wrote its data,
+        see HTTPCache.mark_consumed.
+        """
+        max_age, meta = await self.load_cache_meta(url)
+        if meta and time.time() - meta["stored"] < max_age:
+            return await trio.to_thread.run_sync(self.cache.to_response, url, meta, consumer)
+
+        if not (response := await self.send(url, self.with_validators(headers, meta), meta is not None)):
+            return None
+
+        if response.status_code == 304:
+            await self.refresh_cache_meta(url, meta)
+            return await trio.to_thread.run_sync(self.cache.to_response, url, meta, consumer)
+
+        if max_age is not None:
+            await trio.to_thread.run_sync(self.cache.store, url, response)
+        return response
+
+    @asynccontextmanager
+    async def open_stream(self, url: str, headers: Optional[dict] = None,
+                          consumer: Optional[str] = None) -> AsyncIterator[Optional[tuple[AsyncIterator[bytes], bool]]]:
+        """
+        Like get_response, but the body is read chunk by chunk instead of being loaded at once.
+        Yields the chunks and whether they come unchanged from the cache and have already been
+        written by "consumer", or None if the URL could not be fetched.
+        """
+        max_age, meta = await self.load_cache_meta(url)
+        if meta and time.time() - meta["stored"] < max_age:
+            yield self.cache.iter_body(url), is_consumed(meta, consumer)
+            return
+
+        if not (response := await self.send(url, self.with_validators(headers, meta), meta is not None, stream=True)):
+            yield None
+            return
 
-def get_response(get: Callable[..., Response], url: str) -> Optional[Response]:
-    for i in range(10):
         try:
-            response = get(url)
-            response.raise_for_status()
-            return response
-        except HTTPError as e:
-            print(f"HTTP Error: {e}")
-        except ConnectionError as e:
-            print(f"Connection Error: {e}")
-        except Timeout as e:
-            print(f"Timeout Error: {e}")
-        except RequestException as e:
-            print(f"Request Exception: {e}")
-
-        print(f"\nFailure: {i + 1}")
-        print("Attempt to try again...\n")
-
-        sleep(10)
-
-    return None
+            if response.status_code == 304:
+                await self.refresh_cache_meta(url, meta)
+                yield self.cache.iter_body(url), is_consumed(meta, consumer)
+            elif max_age is not None:
+                yield self.cache.iter_and_store(url, response), False
+            else:
+                yield response.aiter_bytes(), False
+        finally:
+            await response.aclose()
+
+    async def load_cache_meta(self, url: str) -> tuple[Optional[int], Optional[dict]]:
+        max_age = self.cache.max_age(url) if self.cache else None
+        meta = await trio.to_thread.run_sync(self.cache.load_meta, url) if max_age is not None else None
+        return max_age, meta
+
+    async def refresh_cache_meta(self, url: str, meta: dict):
+        meta["stored"] = time.time()
+        await trio.to_thread.run_sync(self.cache.store_meta, url, meta)
+
+    def mark_consumed(self, url: str, consumer: str):
+        if self.cache and self.cache.max_age(url) is not None:
+            self.cache.mark_consumed(url, consumer)
+
+    def with_validators(self, headers: Optional[dict], meta: Optional[dict]) -> Optional[dict]:
+        return (headers or {}) | self.cache.conditional_headers(meta) if meta else headers
+
+    async def send(self, url: str, headers: Optional[dict], accept_not_modified: bool, stream: bool = False) -> Optional[httpx.Response]:
+        """
+        Sends the request, retrying it until it succeeds (or is answered with a 304 when "accept_not_modified")
+        or the attempts run out. A streamed response is returned unread and has to be closed.
+        """
+        host = urlsplit(url).hostname
+        limiters = self.find_limiters(url)
+        for i in range(self.retries.attempts):
+            if i > 0:
+                metrics.inc("fetch_retries", host=host)
+            if limiters:
+                start = monotonic()
+                for limiter in limiters:
+                    await limiter.acquire()
+                metrics.inc("fetch_sleep_seconds", monotonic() - start, host=host, reason="rate_limit")
+
+            try:
+                with metrics.timer("fetch_seconds", host=host):
+                    response = await self.client.send(self.client.build_request("GET", url, headers=headers), stream=stream)
+                if accept_not_modified and response.status_code == 304:
+                    metrics.inc("fetch_requests", host=host, outcome="not_modified")
+                    return response
+                if not response.is_success:
+                    await response.aclose()
+                response.raise_for_status()
+                metrics.inc("fetch_requests", host=host, outcome="ok")
+                return response
+            except httpx.HTTPStatusError as e:
+                logger.warning(f"HTTP Error: {e}")
+            except httpx.TimeoutException as e:
+                logger.warning(f"Timeout Error: {e}")
+            except httpx.TransportError as e:
+                logger.warning(f"Connection Error: {e}")
+            except httpx.HTTPError as e:
+                logger.warning(f"Request Exception: {e}")
+
+            metrics.inc("fetch_requests", host=host, outcome="error")
+            logger.warning(f"Failure: {i + 1} - {url}")
+            if i + 1 < self.retries.attempts:
+                delay = random.uniform(0, min(self.retries.backoff_cap, self.retries.backoff_base * 2 ** i))
+                metrics.inc("fetch_sleep_seconds", delay, host=host, reason="backoff")
+                await trio.sleep(delay)
+
+        return None
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -1,22 +1,30 @@
 import os
-import random
 import time
-from typing import Optional
+from typing import AsyncIterator, Optional
 
-import requests
 from selectolax.lexbor import LexborHTMLParser
 
 from ..utils.card import CardPrice, id_from_info
 from ..utils.logger import setup_logger
-from .fetch import get_response
+from ..utils.parse_pool import ParsePool
+from ..utils.rarity_cache import RarityCache
+from .fetch import Fetcher
 
 logger = setup_logger("TCG Corner scraper", "logs/tcg_corner_scraper.log")
 
+"""
+A collection item: its price, name, set number, rarity, status and the href of its product page.
+The rarity is None when the name does not end with "(rarity)", it is then read from the product page.
+"""
+Listing = tuple[int, str, str, Optional[str], str, str]
+
 
 class TCGCornerScraper:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
+    def __init__(self, fetcher: Fetcher, rarity_cache: Optional[RarityCache] = None, parse_pool: Optional[ParsePool] = None):
+        self.fetcher = fetcher
+        self.parse_pool = parse_pool
+        self.rarity_cache = rarity_cache
+        self.headers = {
             "User-Agent": os.getenv("USER_AGENT"),
             "Cookie": os.getenv("TCG_CORNER_COOKIE").replace("\n", "").strip(),
             "Accept-Language": "ja-JP,ja;q=0.9,fr-FR;q=0.8,fr;q=0.7,en-US;q=0.6,en;q=0.5",
@@ -24,94 +32,156 @@ class TCGCornerScraper:
             "Sec-Fetch-Mode": "cors",
             "Sec-Fetch-Site": "same-origin",
             "Referer": "https://tcg-corner.com"
-        })
+        }
+
+        self.base_endpoint = "https://tcg-corner.com/collections/yu-gi-oh-single-card-asia-english"
+
+        self.checkpoint_key = "tcg_corner"
+        self.page = 1
+        self.tcg_corner_endpoint = self.base_endpoint
+        self.complete = False
+
+    def reset(self):
+        self.page = 1
+        self.tcg_corner_endpoint = self.base_endpoint
+        self.headers["Referer"] = "https://tcg-corner.com"
+        self.complete = False
+
+    def get_state(self) -> dict:
+        return {"page": self.page, "url": self.tcg_corner_endpoint, "referer": self.headers["Referer"]}
+
+    def restore(self, state: dict):
+        self.page = state["page"]
+        self.tcg_corner_endpoint = state["url"]
+        self.headers["Referer"] = state["referer"]
+        self.complete = False
 
-        self.tcg_corner_endpoint = "https://tcg-corner.com/collections/yu-gi-oh-single-card-asia-english"
+    async def scrape(self) -> AsyncIterator[list[CardPrice]]:
+        if self.rarity_cache:
+            self.rarity_cache.reset_counters()
 
-    def scrape(self) -> list[CardPrice]:
-        card_prices = []
-        page = 2
         while True:
-            response = get_response(self.session.get, self.tcg_corner_endpoint)
+            response = await self.fetcher.get_response(self.tcg_corner_endpoint, self.headers)
             if not response:
                 break
 
-            self.session.headers.update({"Referer": self.tcg_corner_endpoint})
-            self.tcg_corner_endpoint = f"https://tcg-corner.com/collections/yu-gi-oh-single-card-asia-english?&page={
-                page}"
+            listings = await self.run_parser(parse_page, response.text)
+            if listings is None:
+                self.complete = True
+                break
 
-            parser = LexborHTMLParser(response.text)
-            collection_items = parser.css("div.collection__item")
+            card_prices = []
+            last_modified = int(time.time())
+            for listing in listings:
+                card_prices.append(await self.create_card_price(listing, last_modified))
 
-            if len(collection_items) <= 0:
-                break
+            self.headers["Referer"] = self.tcg_corner_endpoint
+            self.page += 1
+            self.tcg_corner_endpoint = f"{self.base_endpoint}?&page={self.page}"
+            yield card_prices
 
-            for item in collection_items:
-                card_price = self.parse_card_price(item)
-                if card_price:
-                    card_prices.append(card_price)
             """
 			As TCG Corner prohibits information scraping on their website,
-			I make an effort to limit the number of requests
-			to one every 20 to 25 seconds.
+			I make an effort to limit the number of requests,
+			see HOST_RATE_LIMITS in fetch.py.
 			"""
-            time.sleep(random.randint(20, 25))
             logger.info(
-                f"TCG Corner - Completed scraping page number: {page - 1}")
-            page += 1
-
-        return card_prices
-
-    def parse_card_price(self, item) -> Optional[CardPrice]:
-        try:
-            a_tag = item.css_first("div.product-card__meta-info a")
-            raw_price = item.css_first(
-                "span.price-item--regular[data-product-price]").text()
-
-            name = a_tag.text().strip()
-            info = name.split(" ")
-
-            set_number = info[0]
-            rarity = info[-1]
-            price = int(
-                raw_price.split(" ")[0].replace(
-                    "¥", "").replace(
-                    ",", ""))
-            status = "Sold Out" if item.css_first("li.product-card__label product-card__label--sold-out") else "For Sale"
-
-            if rarity.startswith("("):
-                rarity = rarity.strip("()")
-            else:  # case where there is no "(rarity)" in it
-                rarity = self.parse_rarity(a_tag)
-
-            card_price = CardPrice(
-                id=id_from_info(set_number + rarity),
-                price=price,
-                name=name,
-                set_number=set_number,
-                rarity=rarity,
-                condition="Good",
-                status=status,
-                last_modified=int(time.time())
-            )
-            return card_price
-
-        except AttributeError as e:
-            logger.warning(f"Attribute Error: {e}")
+                f"TCG Corner - Completed scraping page number: {self.page - 1}")
+
+        if self.rarity_cache:
+            logger.info(f"TCG Corner - Rarity cache hits: {self.rarity_cache.hits}, misses: {self.rarity_cache.misses}")
+
+    async def run_parser(self, fn, html: str):
+        if self.parse_pool:
+            return await self.parse_pool.run(fn, html)
+
+        return fn(html)
+
+    async def create_card_price(self, listing: Listing, last_modified: int) -> CardPrice:
+        price, name, set_number, rarity, status, href = listing
+        if rarity is None:
+            rarity = await self.parse_rarity(href)
+
+        return CardPrice(
+            id=id_from_info(set_number + rarity),
+            price=price,
+            name=name,
+            set_number=set_number,
+            rarity=rarity,
+            condition="Good",
+            status=status,
+            last_modified=last_modified
+        )
+
+    async def parse_rarity(self, href: str) -> str:
+        if self.rarity_cache and (rarity := self.rarity_cache.get(href)):
+            return rarity
+
+        url = f"https://tcg-corner.com{href}"
+        # The product is linked from the collection page being parsed
+        response = await self.fetcher.get_response(url, self.headers | {"Referer": self.tcg_corner_endpoint})
+
+        if response and (rarity := await self.run_parser(parse_product_rarity, response.text)):
+            if self.rarity_cache:
+                self.rarity_cache.set(href, rarity)
+            return rarity
+
+        return "Undefined"
+
 
+def parse_page(html: str) -> Optional[list[Listing]]:
+    """
+    Can run in a parse worker, see ParsePool.
+    Returns None when the page has no items, which means that the previous page was the last one.
+    """
+    parser = LexborHTMLParser(html)
+    collection_items = parser.css("div.collection__item")
+    if len(collection_items) <= 0:
         return None
 
-    def parse_rarity(self, a_tag) -> str:
-        time.sleep(random.randint(10, 15))
+    listings = []
+    for item in collection_items:
+        if (listing := parse_listing(item)):
+            listings.append(listing)
 
-        url = f"https://tcg-corner.com{a_tag.attrs['href']}"
-        response = get_response(self.session.get, url)
+    return listings
 
-        if response:
-            parser = LexborHTMLParser(response.text)
-            for br in parser.tags('br'):
-                next_s = br.next
-                if next_s and "Rarity" in next_s.text():
-                    return next_s.text().split(":")[1].strip()
 
-        return "Undefined"
+def parse_listing(item) -> Optional[Listing]:
+    try:
+        a_tag = item.css_first("div.product-card__meta-info a")
+        raw_price = item.css_first(
+            "span.price-item--regular[data-product-price]").text()
+
+        name = a_tag.text().strip()
+        info = name.split(" ")
+
+        set_number = info[0]
+        rarity = info[-1]
+        price = int(
+            raw_price.split(" ")[0].replace(
+                "¥", "").replace(
+                ",", ""))
+        status = "Sold Out" if item.css_first("li.product-card__label product-card__label--sold-out") else "For Sale"
+
+        if rarity.startswith("("):
+            rarity = rarity.strip("()")
+        else:  # case where there is no "(rarity)" in it
+            rarity = None
+
+        return (price, name, set_number, rarity, status, a_tag.attrs['href'])
+
+    except AttributeError as e:
+        logger.warning(f"Attribute Error: {e}")
+
+    return None
+
+
+def parse_product_rarity(html: str) -> Optional[str]:
+    parser = LexborHTMLParser(html)
+    for br in parser.tags('br'):
+        next_s = br.next
+        if next_s and "Rarity" in next_s.text():
+            return next_s.text().split(":")[1].strip()
+
+    return None
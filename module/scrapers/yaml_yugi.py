@@ -1,10 +1,10 @@
-from typing import Optional
-
-import requests
+from functools import partial
+from typing import AsyncIterator, Callable, Optional
 
 from ..utils.card import Card, Name, Sets, remove_duplicates_sets
+from ..utils.json_stream import iter_json_array
 from ..utils.string_manip import parse_and_expand_ruby
-from .fetch import get_response
+from .fetch import Fetcher
 
 """
 Keep in mind that we will only obtain
@@ -13,15 +13,36 @@ the data required for the Kitt bot.
 
 
 class YAMLYugiScraper:
-    def __init__(self):
+    def __init__(self, fetcher: Fetcher, consumer: Optional[str] = None):
+        self.fetcher = fetcher
+        # The collection the cards are written to, see HTTPCache.mark_consumed
+        self.consumer = consumer
         self.yaml_yugi_endpoint = "https://raw.githubusercontent.com/DawnbrandBots/yaml-yugi/aggregate/cards.json"
 
-    def scrape(self) -> Optional[list[Card]]:
-        response = get_response(requests.get, self.yaml_yugi_endpoint)
-        if response:
-            return self.parse_cards(response.json())
+    async def scrape(self, force: bool = False, batch_size: int = 1000) -> AsyncIterator[tuple[list[Card], Optional[Callable[[], None]]]]:
+        """
+        The aggregate is parsed while it is downloaded and its cards are yielded
+        in batches of "batch_size", so only one batch is held in memory at a time.
+        Unless "force" is set, an unchanged aggregate is not parsed again
+        once its cards have been written to the collection.
+        The last batch comes with the callback to call once it has been written.
+        """
+        async with self.fetcher.open_stream(self.yaml_yugi_endpoint, consumer=self.consumer) as stream:
+            if not stream:
+                return
+            chunks, not_modified = stream
+            if not_modified and not force:
+                return
+
+            raw_cards = []
+            async for raw_card in iter_json_array(chunks):
+                raw_cards.append(raw_card)
+                if len(raw_cards) >= batch_size:
+                    yield self.parse_cards(raw_cards), None
+                    raw_cards = []
 
-        return None
+            on_written = partial(self.fetcher.mark_consumed, self.yaml_yugi_endpoint, self.consumer) if self.consumer else None
+            yield self.parse_cards(raw_cards), on_written
 
     def parse_cards(self, raw_cards: list[dict]) -> list[Card]:
         cards = []
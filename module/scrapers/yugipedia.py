@@ -1,34 +1,40 @@
-import time
+from functools import partial
 from platform import python_version
-from typing import Optional
+from typing import AsyncIterator, Callable, Optional
 from urllib import parse
 
-import requests
+import httpx
+import trio
 
 from ..utils.card import Card, Name
 from ..utils.safe import get
-from .fetch import get_response
+from .fetch import Fetcher, is_not_modified
 
 """
 We will have to use Yugipedia because YAML Yugi does not have
 some things, like set numbers in Asian English.
 """
 
+# The cards of a page, and the callback to call once they have been written
+Page = tuple[list[Card], Optional[Callable[[], None]]]
+
 
 class YugipediaScraper:
-    def __init__(self):
-        self.session = requests.Session()
+    def __init__(self, fetcher: Fetcher, consumer: Optional[str] = None):
+        self.fetcher = fetcher
+        # The collection the cards are written to, see HTTPCache.mark_consumed
+        self.consumer = consumer
         # Yugipedia requires you to leave service and contact information.
-        self.session.headers.update(
-            {"User-Agent": f"https://github.com/Satellaa/Dotscaper.git requests/{requests.__version__} py/{python_version()}"})
-        self.asian_english_endpoint = self.create_yugipedia_endpoint(
-            "Asian-English", limit=5000)
-        self.tokens_endpoint = self.create_yugipedia_endpoint(
-            "Japanese", "[[Set contains.English name::Token]]")
-        self.illegal_cards_endpoint = self.create_yugipedia_endpoint(
-            "Japanese", "[[Set contains.OCG status::Illegal]]")
-        self.counters_endpoint = self.create_yugipedia_endpoint(
-            "Japanese", "[[Set contains.Card type::Counter]]")
+        self.headers = {"User-Agent": f"https://github.com/Satellaa/Dotscaper.git httpx/{httpx.__version__} py/{python_version()}"}
+        # The endpoints are called with the offset of the page to fetch
+        self.asian_english_endpoint = partial(self.create_yugipedia_endpoint,
+                                              "Asian-English", limit=5000)
+        self.tokens_endpoint = partial(self.create_yugipedia_endpoint,
+                                       "Japanese", "[[Set contains.English name::Token]]")
+        self.illegal_cards_endpoint = partial(self.create_yugipedia_endpoint,
+                                              "Japanese", "[[Set contains.OCG status::Illegal]]")
+        self.counters_endpoint = partial(self.create_yugipedia_endpoint,
+                                         "Japanese", "[[Set contains.Card type::Counter]]")
 
         self.scrape_funs = [
             self.scrape_asian_english_sets,
@@ -37,40 +43,61 @@ class YugipediaScraper:
             self.scrape_illegal_cards
         ]
 
-    def scrape_all(self) -> list[Card]:
-        cards = []
-        for fun in self.scrape_funs:
-            if (result := fun()):
-                cards += result
-            time.sleep(2)
-
-        return cards
-
-    def scrape_asian_english_sets(self) -> Optional[list[Card]]:
-        return self.scrape(self.asian_english_endpoint, "ae")
-
-    def scrape_counters(self) -> Optional[list[Card]]:
-        return self.scrape(self.counters_endpoint)
-
-    def scrape_tokens(self) -> Optional[list[Card]]:
-        return self.scrape(self.tokens_endpoint)
-
-    def scrape_illegal_cards(self) -> Optional[list[Card]]:
-        return self.scrape(self.illegal_cards_endpoint)
-
-    def scrape(self, url: str, set_language: str = "ja") -> Optional[list[Card]]:
-        response = get_response(self.session.get, url)
-        if response:
-            return self.parse_cards(response.json(), set_language)
-
-        return None
+    async def scrape_all(self, send_channel: trio.MemorySendChannel, force: bool = False):
+        """
+        The queries run concurrently and send their cards to "send_channel" page by page,
+        it is closed once they are all done. The fetcher still spaces their requests,
+        see HOST_RATE_LIMITS in fetch.py
+        """
+        async with send_channel, trio.open_nursery() as nursery:
+            for fun in self.scrape_funs:
+                nursery.start_soon(self.send_cards, fun(force), send_channel.clone())
+
+    async def send_cards(self, pages: AsyncIterator[Page], send_channel: trio.MemorySendChannel):
+        async with send_channel:
+            async for page in pages:
+                await send_channel.send(page)
+
+    def scrape_asian_english_sets(self, force: bool = False) -> AsyncIterator[Page]:
+        return self.scrape(self.asian_english_endpoint, "ae", force)
+
+    def scrape_counters(self, force: bool = False) -> AsyncIterator[Page]:
+        return self.scrape(self.counters_endpoint, force=force)
+
+    def scrape_tokens(self, force: bool = False) -> AsyncIterator[Page]:
+        return self.scrape(self.tokens_endpoint, force=force)
+
+    def scrape_illegal_cards(self, force: bool = False) -> AsyncIterator[Page]:
+        return self.scrape(self.illegal_cards_endpoint, force=force)
+
+    async def scrape(self, endpoint: Callable[..., str], set_language: str = "ja", force: bool = False) -> AsyncIterator[Page]:
+        """
+        Follows "query-continue-offset" until the results are exhausted and yields the cards of every page,
+        with the callback to call once they have been written.
+        Unless "force" is set, unchanged pages are not parsed again
+        once their cards have been written to the collection.
+        """
+        offset = 0
+        while offset is not None:
+            url = endpoint(offset=offset)
+            response = await self.fetcher.get_response(url, self.headers, self.consumer)
+            if not response:
+                return
+
+            raw_cards = response.json()
+            if force or not is_not_modified(response):
+                on_written = partial(self.fetcher.mark_consumed, url, self.consumer) if self.consumer else None
+                yield self.parse_cards(raw_cards, set_language), on_written
+
+            offset = raw_cards.get("query-continue-offset")
 
     def parse_cards(
             self,
             raw_cards: list[dict],
             set_language: str) -> list[Card]:
         cards = []
-        for raw_card in raw_cards["query"]["results"].values():
+        # Empty results are an empty list instead of an object
+        for raw_card in (raw_cards["query"]["results"] or {}).values():
             printouts = raw_card["printouts"]
             set_number = get(printouts["Card number"], 0, [])
             en_name = get(printouts["English name"], 0, "")
@@ -107,9 +134,10 @@ class YugipediaScraper:
             self,
             local: str,
             conditions: str = "",
-            limit: int = 500) -> str:
+            limit: int = 500,
+            offset: int = 0) -> str:
         params = {"action": "ask", "query": f"""[[-Has subobject.Locality::{local}]] {
             conditions}|?Card number|?Set contains.English name|?Set contains.Japanese base name|?Set contains.Database ID|?Set contains.Password|
-            limit={limit}|offset=0""", "format": "json"}
+            limit={limit}|offset={offset}""", "format": "json"}
 
         return f"https://yugipedia.com/api.php?{parse.urlencode(params)}"
@@ -1,99 +1,153 @@
 import os
-import random
 import time
-from typing import Optional
+from typing import AsyncIterator, Optional
 
-import requests
 from selectolax.lexbor import LexborHTMLParser
 
-from ..utils.card import CardPrice, id_from_info
+from ..utils.card import (CardPrice, CardPriceTuple, card_price_from_tuple,
+                          id_from_info)
 from ..utils.logger import setup_logger
-from .fetch import get_response
+from ..utils.parse_pool import ParsePool
+from .fetch import Fetcher
 
 logger = setup_logger("Yuyu-tei scraper", "logs/yuyutei_scraper.log")
 
 
 class YuyuteiScraper:
-    def __init__(self, kizu: str = ""):
-        self.session = requests.Session()
-        self.session.headers.update({
+    def __init__(self, fetcher: Fetcher, kizu: str = "", parse_pool: Optional[ParsePool] = None):
+        self.fetcher = fetcher
+        self.parse_pool = parse_pool
+        self.headers = {
             "User-Agent": os.getenv("USER_AGENT"),
             "Cookie": os.getenv("YUYUTEI_COOKIE").replace("\n", "").strip(),
             "Accept-Language": "ja-JP,ja;q=0.9,fr-FR;q=0.8,fr;q=0.7,en-US;q=0.6,en;q=0.5",
             "Referer": "https://yuyu-tei.jp/top/ygo"
-        })
+        }
 
         self.kizu = kizu
-        self.yuyutei_endpoint = f"https://yuyu-tei.jp/sell/ygo/s/search?search_word=&{kizu}"
+        self.base_endpoint = f"https://yuyu-tei.jp/sell/ygo/s/search?search_word=&{kizu}"
 
-    def scrape(self) -> list[CardPrice]:
-        card_prices = []
-        page = 2
+        self.checkpoint_key = f"yuyutei:{kizu}" if kizu else "yuyutei"
+        self.page = 1
+        self.yuyutei_endpoint = self.base_endpoint
+        self.complete = False
+
+    def reset(self):
+        self.page = 1
+        self.yuyutei_endpoint = self.base_endpoint
+        self.headers["Referer"] = "https://yuyu-tei.jp/top/ygo"
+        self.complete = False
+
+    def get_state(self) -> dict:
+        return {"page": self.page, "url": self.yuyutei_endpoint, "referer": self.headers["Referer"]}
+
+    def restore(self, state: dict):
+        self.page = state["page"]
+        self.yuyutei_endpoint = state["url"]
+        self.headers["Referer"] = state["referer"]
+        self.complete = False
+
+    async def scrape(self) -> AsyncIterator[list[CardPrice]]:
         while True:
-            response = get_response(self.session.get, self.yuyutei_endpoint)
+            response = await self.fetcher.get_response(self.yuyutei_endpoint, self.headers)
             if not response:
                 break
 
-            self.session.headers.update({"Referer": self.yuyutei_endpoint})
-            self.yuyutei_endpoint = self.yuyutei_endpoint + f"&page={page}"
-
-            parser = LexborHTMLParser(response.text)
-            items = parser.css("div.py-4.cards-list")
-            if not items:
+            card_prices = await self.parse(response.text)
+            if card_prices is None:
+                self.complete = True
                 break
 
-            for item in items:
-                rarity = self.parse_rarity(item)
-                cards = item.css("div.card-product")
-                for card in cards:
-                    card_price = self.parse_card_price(card, rarity)
-                    if card_price:
-                        card_prices.append(card_price)
+            self.headers["Referer"] = self.yuyutei_endpoint
+            self.page += 1
+            self.yuyutei_endpoint = f"{self.base_endpoint}&page={self.page}"
+            yield card_prices
+
             """
             As Yuyutei prohibits information scraping on their website,
-            I make an effort to limit the number of requests
-            to one every 20 to 25 seconds.
+            I make an effort to limit the number of requests,
+            see HOST_RATE_LIMITS in fetch.py.
             """
-            time.sleep(random.randint(20, 25))
             logger.info(
-                f"Yuyutei {'kizu' if self.kizu else ''} - Completed scraping page number: {page - 1}")
-            page += 1
-
-        return card_prices
-
-    def parse_card_price(self, card, rarity: str) -> Optional[CardPrice]:
-        try:
-            name = card.css_first("h4.text-primary.fw-bold").text()
-            price = int(card.css_first("strong[class^='d-block text-end']")
-                        .text().split(" ")[0]
-                        .replace(",", "")
-                        )
-            set_number = card.css_first("span.d-block.border.border-dark.p-1.w-100.text-center.my-2")
-            set_number = "Undefined" if not set_number or set_number.text() == "-" else set_number.text()
-
-            condition = "Scratch" if self.kizu else "Good"
-            status = "Sold Out" if "sold-out" in card.attributes["class"] else "For Sale"
-            id = id_from_info((set_number + rarity + condition + name).replace(" ", ""))
-            return CardPrice(
-                id=id,
-                price=price,
-                name=name,
-                set_number=set_number,
-                rarity=rarity,
-                condition=condition,
-                status=status,
-                last_modified=int(time.time())
-            )
-
-        except AttributeError as e:
-            logger.warning(f"Attribute Error: {e}")
+                f"Yuyutei {'kizu' if self.kizu else ''} - Completed scraping page number: {self.page - 1}")
+
+    async def parse(self, html: str) -> Optional[list[CardPrice]]:
+        condition = "Scratch" if self.kizu else "Good"
+        if self.parse_pool:
+            page = await self.parse_pool.run(parse_page, html, condition)
+        else:
+            page = parse_page(html, condition)
+
+        if page is None:
+            return None
+
+        last_modified = int(time.time())
+        return [card_price_from_tuple(card_price, last_modified) for card_price in page]
+
+
+"""
+Every node the extractor reads, matched by one selector in a single walk of the page.
+Lexbor returns the matches in document order, so the rarity and cards of a block
+follow the block, and the name, price and set number of a card follow the card.
+"""
+PAGE_SELECTOR = ", ".join([
+    "div.py-4.cards-list",
+    "span.py-2.d-inline-block.px-2.me-2.text-white.fw-bold",
+    "div.card-product",
+    "h4.text-primary.fw-bold",
+    "strong[class^='d-block text-end']",
+    "span.d-block.border.border-dark.p-1.w-100.text-center.my-2",
+])
+
+
+def parse_page(html: str, condition: str) -> Optional[list[CardPriceTuple]]:
+    """
+    Can run in a parse worker, see ParsePool.
+    Returns None when the page has no cards, which means that the previous page was the last one.
+    """
+    blocks = []
+    for node in LexborHTMLParser(html).css(PAGE_SELECTOR):
+        tag = node.tag
+        if tag == "div":
+            classes = node.attributes.get("class") or ""
+            if "cards-list" in classes:
+                blocks.append({"rarity": None, "cards": []})
+            elif blocks:
+                blocks[-1]["cards"].append({"sold_out": "sold-out" in classes})
+        elif tag == "span" and "border-dark" not in (node.attributes.get("class") or ""):
+            # The first rarity of a block is used for all its cards
+            if blocks and blocks[-1]["rarity"] is None:
+                blocks[-1]["rarity"] = node.text()
+        elif blocks and blocks[-1]["cards"] and tag not in blocks[-1]["cards"][-1]:
+            # The first name (h4), price (strong) and set number (span) of a card
+            blocks[-1]["cards"][-1][tag] = node.text()
+
+    if not blocks:
+        return None
+
+    card_prices = []
+    for block in blocks:
+        rarity = block["rarity"]
+        if rarity is None:
+            logger.warning("Rarity not found in a cards-list")
+            rarity = ""
+
+        for card in block["cards"]:
+            if (card_price := create_card_price(card, rarity, condition)):
+                card_prices.append(card_price)
+
+    return card_prices
+
 
+def create_card_price(card: dict, rarity: str, condition: str) -> Optional[CardPriceTuple]:
+    if "h4" not in card or "strong" not in card:
+        logger.warning(f"Name or price not found in a card-product: {card}")
         return None
 
-    def parse_rarity(self, item) -> str:
-        try:
-            return item.css_first("span.py-2.d-inline-block.px-2.me-2.text-white.fw-bold").text()
-        except AttributeError as e:
-            logger.warning(f"Attribute Error: {e}")
+    name = card["h4"]
+    price = int(card["strong"].split(" ")[0].replace(",", ""))
+    set_number = "Undefined" if card.get("span", "-") == "-" else card["span"]
 
-        return ""
+    status = "Sold Out" if card["sold_out"] else "For Sale"
+    id = id_from_info((set_number + rarity + condition + name).replace(" ", ""))
+    return (id, price, name, set_number, rarity, condition, status)
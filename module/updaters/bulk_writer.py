@@ -0,0 +1,158 @@
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Callable, Optional
+
+from pymongo.collection import Collection
+
+from ..utils.config import WriteConfig
+from ..utils.logger import setup_logger
+from ..utils.metrics import SIZE_BUCKETS, metrics
+
+logger = setup_logger("bulk writer", "logs/bulk_writer.log")
+
+# The summaries of the last chunks kept for pop_summaries, every chunk is also logged
+MAX_SUMMARIES = 1000
+
+
+class BulkWriter:
+    """
+    Writes the operations of an updater in chunks of "flush_size" while it keeps adding them.
+    With "background", the chunks are written by one thread while the next ones are collected,
+    one at a time and in the order they were submitted, as a chunk may update or upsert
+    the documents of an earlier one; at most two chunks wait to be written at a time.
+    With "ordered", the operations of a chunk are also written in order,
+    so that several upserts of the same new document do not insert it twice.
+    A callback added with submit_if_full is called once the chunk being collected and every chunk
+    before it have been written, by the thread that adds the operations, and never if one of them fails.
+    "after_write" is called with the ids of the documents of every chunk, as they were added with
+    its operations, once it has been written, by the thread that wrote it.
+    """
+
+    def __init__(self, coll: Collection, name: str, config: WriteConfig, after_write: Optional[Callable[[list], None]] = None):
+        write_concern = config.get_write_concern()
+        self.coll = coll.with_options(write_concern=write_concern) if write_concern else coll
+        self.name = name
+        self.chunk_size = config.flush_size
+        self.after_write = after_write
+        self.ordered = config.ordered
+        self.operations = []
+        self.document_ids = []
+
+        # A single thread runs the writes first in, first out
+        self.pool = ThreadPoolExecutor(1, thread_name_prefix=f"{name} writer") if config.background else None
+        self.max_pending = 2
+        self.pending: deque[tuple[Future, list[Callable[[], None]]]] = deque()
+        # The callbacks waiting for the chunk being collected
+        self.callbacks: list[Callable[[], None]] = []
+
+        # Updated by the writer threads
+        self.lock = Lock()
+        self.written = 0
+        # Bounded, as a daemon writes chunks for as long as it runs and nothing pops them
+        self.summaries: deque[dict] = deque(maxlen=MAX_SUMMARIES)
+
+    def add(self, operation, document_id=None):
+        self.operations.append(operation)
+        self.document_ids.append(document_id)
+
+    def replace(self, index: int, operation):
+        """
+        Replaces an operation that has not been submitted yet, None removes it.
+        """
+        self.operations[index] = operation
+
+    def submit_if_full(self, on_written: Optional[Callable[[], None]] = None) -> bool:
+        if on_written:
+            self.callbacks.append(on_written)
+        if len(self.operations) >= self.chunk_size:
+            self.submit()
+            return True
+
+        self.complete_written()
+        return False
+
+    def submit(self):
+        chunk = [operation for operation in self.operations if operation is not None]
+        document_ids = [id for operation, id in zip(self.operations, self.document_ids) if operation is not None]
+        callbacks = self.callbacks
+        self.operations, self.document_ids, self.callbacks = [], [], []
+        if not self.pool:
+            self.write(chunk, document_ids)
+            for on_written in callbacks:
+                on_written()
+            return
+
+        self.pending.append((self.pool.submit(self.write, chunk, document_ids), callbacks))
+        self.complete_written()
+        while len(self.pending) > self.max_pending:
+            self.complete_oldest()
+
+    def flush(self):
+        """
+        Writes the remaining operations and waits for every chunk to be written.
+        """
+        if self.operations or self.callbacks:
+            self.submit()
+        while self.pending:
+            self.complete_oldest()
+
+    def reset(self):
+        """
+        After a failed write, drops the operations and callbacks that have not been submitted,
+        and waits for the chunks still being written without calling their callbacks.
+        """
+        self.operations, self.document_ids, self.callbacks = [], [], []
+        wait([future for future, _ in self.pending])
+        self.pending.clear()
+
+    def has_operations(self) -> bool:
+        return bool(self.operations or self.callbacks or self.pending)
+
+    def complete_written(self):
+        while self.pending and self.pending[0][0].done():
+            self.complete_oldest()
+
+    def complete_oldest(self):
+        future, callbacks = self.pending.popleft()
+        # Raises the error of a failed write in the thread that adds the operations
+        future.result()
+        for on_written in callbacks:
+            on_written()
+
+    def write(self, chunk: list, document_ids: list):
+        if not chunk:
+            return
+
+        metrics.observe("bulk_write_operations", len(chunk), SIZE_BUCKETS, updater=self.name)
+        start = time.monotonic()
+        result = self.coll.bulk_write(chunk, ordered=self.ordered)
+        seconds = time.monotonic() - start
+        if self.after_write:
+            self.after_write(document_ids)
+        metrics.observe("bulk_write_seconds", seconds, updater=self.name)
+
+        # An unacknowledged write (w=0) has no counts
+        summary = {"operations": len(chunk), "seconds": round(seconds, 3)}
+        if result is not None and result.acknowledged:
+            summary |= {"matched": result.matched_count, "modified": result.modified_count, "upserted": result.upserted_count}
+            for field in ["matched", "modified", "upserted"]:
+                metrics.inc("bulk_write_documents", summary[field], updater=self.name, result=field)
+
+        with self.lock:
+            self.written += len(chunk)
+            self.summaries.append(summary)
+
+        counts = f": {summary['matched']} matched, {summary['modified']} modified, {summary['upserted']} upserted" if "matched" in summary else ""
+        logger.info(f"{self.name} - Wrote {len(chunk)} operations in {seconds:.2f}s{counts}")
+
+    def pop_summaries(self) -> list[dict]:
+        with self.lock:
+            summaries = list(self.summaries)
+            self.summaries.clear()
+            return summaries
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
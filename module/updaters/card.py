@@ -1,64 +1,151 @@
-from typing import Optional
+import hashlib
+import json
+from dataclasses import replace
+from threading import Lock
+from typing import Callable, Optional
 
 from pymongo import UpdateOne
-from pymongo.collection import Collection
 
-from ..utils.card import Card
+from ..utils.card import MARKETS, Card
+from ..utils.config import WriteConfig
 from ..utils.logger import setup_logger
 from ..utils.string_manip import half_to_full
+from .bulk_writer import BulkWriter
+from .snapshot import CardSnapshot
 
 logger = setup_logger("card info updater", "logs/card_info_updater.log")
 
 
+def content_hash(card: Card) -> str:
+    return hashlib.sha1(json.dumps(card, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
 class CardUpdater:
-    def __init__(self, coll: Collection[Card]):
-        self.coll = coll
-        self.operations = []
+    """
+    Only new or changed cards are written: the fields that are $set are compared with
+    the stored document through a content hash kept on it, and sets are only added when
+    the stored document does not have them yet.
+    Cards can be added in batches while they are being scraped, the operations
+    are written every "flush_size" operations instead of all at once, to the collection of the snapshot.
+    """
+
+    def __init__(self, snapshot: CardSnapshot, config: Optional[WriteConfig] = None):
+        self.coll = snapshot.coll
+        self.snapshot = snapshot
+        # Several upserts of the same new card can be in a chunk
+        self.writer = BulkWriter(self.coll, "card_info", replace(config or WriteConfig(), ordered=True))
+        self.stored_cards: Optional[dict[tuple, dict]] = None
+        # New cards get their "card_prices" when they are inserted, only cards stored before that need the field
+        self.card_prices_field_set = False
+        # Batches are added from worker threads
+        self.lock = Lock()
 
     def execute(self):
-        if self.operations:
-            self.coll.bulk_write(self.operations, ordered=False)
-            self.set_card_prices_field()
-        else:
-            logger.debug("There are no operations to complete.")
+        with self.lock:
+            if self.writer.has_operations():
+                self.writer.flush()
+            elif not self.writer.written:
+                logger.debug("There are no operations to complete.")
+
+            if self.writer.written:
+                if not self.card_prices_field_set:
+                    self.set_card_prices_field()
+                    self.card_prices_field_set = True
+                self.snapshot.invalidate()
+
+            self.writer.written = 0
+            self.stored_cards = None
+
+    def reset(self):
+        """
+        Forgets the operations and stored cards of a run that failed.
+        """
+        with self.lock:
+            self.writer.reset()
+            self.writer.written = 0
+            self.stored_cards = None
 
     def set_card_prices_field(self):
         filter = {"card_prices": {"$exists": False}}
-        card_prices = {
-            "card_prices": {
-                "bigweb": [],
-                "yuyutei": [],
-                "tcg_corner": []}}
+        card_prices = {"card_prices": {market: [] for market in MARKETS}}
 
         self.coll.update_many(filter, {"$set": card_prices})
 
-    def add(self, cards: Optional[list[Card]]):
-        if not cards:
-            return
+    def load_stored_cards(self) -> dict[tuple, dict]:
+        """
+        Stored cards are keyed like the filters of the update operations,
+        by konami_id, or by English name for cards without one.
+        """
+        stored_cards = {}
+        projection = {"_id": 0, "konami_id": 1, "name.en": 1, "content_hash": 1, "sets": 1}
+        for document in self.coll.find({}, projection):
+            stored_card = {
+                "content_hash": document.get("content_hash"),
+                "sets": {locale: {set["set_number"] for set in document.get("sets", {}).get(locale, [])} for locale in ["ja", "ae"]}
+            }
+            if document.get("konami_id", 0) > 0:
+                stored_cards[("konami_id", document["konami_id"])] = stored_card
+            stored_cards.setdefault(("name.en", document.get("name", {}).get("en")), stored_card)
+
+        return stored_cards
+
+    def add(self, cards: Optional[list[Card]], on_written: Optional[Callable[[], None]] = None):
+        """
+        "on_written" is called once the operations from these cards,
+        and every operation before them, have been written.
+        """
+        with self.lock:
+            if cards:
+                self.add_batch(cards)
+            self.writer.submit_if_full(on_written)
 
+    def add_batch(self, cards: list[Card]):
+        if self.stored_cards is None:
+            self.stored_cards = self.load_stored_cards()
+
+        count = 0
         for card in cards:
             try:
-                operation = self.create_update_operation(card)
-                self.operations.append(operation)
+                if (operation := self.create_update_operation(card)):
+                    self.writer.add(operation)
+                    count += 1
             except KeyError as e:
                 logger.warning(
                     f"card: {card} ---- does not have a key name: {e}")
 
-    def create_update_operation(self, card: Card) -> UpdateOne:
+        logger.info(f"{count} of {len(cards)} cards are new or changed")
+
+    def create_update_operation(self, card: Card) -> Optional[UpdateOne]:
         filter = {
             "konami_id": card["konami_id"]} if card["konami_id"] > 0 else {
             "name.en": card["name"]["en"]}
+        key = next(iter(filter.items()))
 
         sets = card.pop("sets")
-        ja_sets = {"$each": sets.get("ja", [])}
-        ae_sets = {"$each": sets.get("ae", [])}
-
         card["name"]["ja"] = half_to_full(card["name"]["ja"])
+        card["content_hash"] = content_hash(card)
+
+        is_new = key not in self.stored_cards
+        stored_card = self.stored_cards.setdefault(key, {"content_hash": None, "sets": {"ja": set(), "ae": set()}})
 
+        update = {}
         set_or_set_on_insert = "$set" if card["konami_id"] > 0 else "$setOnInsert"
-        update = {
-            f"{set_or_set_on_insert}": card,
-            "$addToSet": {"sets.ja": ja_sets, "sets.ae": ae_sets}
-        }
+        # $setOnInsert only matters for a new document
+        if is_new or (set_or_set_on_insert == "$set" and stored_card["content_hash"] != card["content_hash"]):
+            update[set_or_set_on_insert] = card
+            stored_card["content_hash"] = card["content_hash"]
+
+        if is_new:
+            update.setdefault("$setOnInsert", {})["card_prices"] = {market: [] for market in MARKETS}
+
+        for locale in ["ja", "ae"]:
+            new_sets = [set for set in sets.get(locale, []) if set["set_number"] not in stored_card["sets"][locale]]
+            # A new document always gets both arrays, even if they are empty
+            if new_sets or is_new:
+                update.setdefault("$addToSet", {})[f"sets.{locale}"] = {"$each": new_sets}
+                stored_card["sets"][locale].update(set["set_number"] for set in new_sets)
+
+        if update:
+            return UpdateOne(filter, update, upsert=True)
 
-        return UpdateOne(filter, update, upsert=True)
+        return None
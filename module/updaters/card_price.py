@@ -1,28 +1,60 @@
-from typing import Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Optional
 
 from pymongo import UpdateOne
-from pymongo.collection import Collection
 
-from ..utils.card import Card, CardPrice
+from ..utils.card import MARKETS, Card, CardPrice, PricePoint
+from ..utils.config import Config
 from ..utils.logger import setup_logger
-from ..utils.query import create_name_filter
+from ..utils.metrics import metrics
+from ..utils.query import (create_batch_name_pipeline, create_name_filter,
+                           create_price_summary_pipeline)
+from .bulk_writer import BulkWriter
+from .price_history import PriceHistory
+from .snapshot import CardSnapshot, PriceEntry, PriceKey
 
 logger = setup_logger("card price updater", "logs/card_price_updater.log")
 
+# The status of a price whose listing is no longer on the market, next to "For Sale" and "Sold Out"
+REMOVED_STATUS = "Removed"
+# A crawl that saw fewer of the stored listings than this probably stopped at a blank page or a captcha
+# that the scraper took for the last page, so what it did not see is not swept
+MIN_SWEEP_SEEN_RATIO = 0.5
+# The markets whose prices are checked for tokens and unsafe listings when they are matched by name
+CHECK_SAFE_MARKETS = ["bigweb", "yuyutei"]
+
 
 class CardPriceUpdater:
-    def __init__(self, coll: Collection[Card], market: str, check_safe: bool = False):
-        self.coll = coll
+    def __init__(self, snapshot: CardSnapshot, market: str, config: Optional[Config] = None, history: Optional[PriceHistory] = None):
+        config = config or Config()
+        # The prices are written to the collection of the snapshot
+        self.coll = snapshot.coll
+        self.snapshot = snapshot
         self.market = market
-        self.operations = []
 
-        self.all_cards = list(coll.find())
+        # Scraped pages are added as they arrive, possibly from several scrapers (threads) at once,
+        # and the operations are written every "flush_size" operations so a crash only loses the last few pages.
+        self.lock = Lock()
+        self.writer = BulkWriter(self.coll, market, config.write, self.update_price_summaries)
+        self.price_summary_pipeline = create_price_summary_pipeline(MARKETS)
+        # The index in the chunk being collected of the operation queued for a price of a card,
+        # and the price it was diffed against
+        self.queued: dict[PriceKey, tuple[int, Optional[PriceEntry]]] = {}
+        # The card and id of every price scraped since the last sweep, with no card (None) if it did not match
+        self.seen: set[PriceKey] = set()
+        # Gets a point for every price that is added or changes
+        self.history = history
+
+        # See NameSearchConfig
+        self.name_search = config.name_search
 
         self.card_language = "en" if self.market == "tcg_corner" else "ja"
         self.set_locale = "ae" if self.market == "tcg_corner" else "ja"
 
-        self.check_safe = check_safe
-        if check_safe:
+        self.check_safe = market in CHECK_SAFE_MARKETS
+        if self.check_safe:
             # "Token Thanksgiving", "Token Feastevil", "Token Sundae", "Oh Tokenbaum!"
             self.token_in_name_list = [6364, 5733, 9348, 10467]
             self.token_prefix_list = ["JPT", "JPS"]
@@ -30,43 +62,198 @@ class CardPriceUpdater:
             self.unsafe_comment_list = ["-EN", "-AE"]
 
     def execute(self):
-        if self.operations:
-            self.coll.bulk_write(self.operations, ordered=False)
-        else:
-            logger.debug("There are no operations to complete.")
+        with self.lock:
+            if self.writer.has_operations():
+                self.writer.flush()
+                self.queued = {}
+            else:
+                logger.debug("There are no operations to complete.")
 
-    def add(self, card_prices: Optional[list[CardPrice]]):
-        if not card_prices:
-            return
+            if self.history:
+                self.history.flush()
+
+    def reset(self):
+        """
+        Forgets the operations, queued prices and seen ids of a run that failed.
+        """
+        with self.lock:
+            self.writer.reset()
+            self.queued = {}
+            self.seen = set()
 
+    def add(self, card_prices: Optional[list[CardPrice]], on_written: Optional[Callable[[], None]] = None):
+        """
+        "on_written" is called once the operations from these card prices,
+        and every operation before them, have been written.
+        """
+        with self.lock:
+            if card_prices:
+                with metrics.timer("match_seconds", market=self.market):
+                    self.add_page(card_prices)
+            if self.writer.submit_if_full(on_written):
+                self.queued = {}
+
+    def add_page(self, card_prices: list[CardPrice]):
+        # Prices without a set number match are looked up by name all at once,
+        # so that the "atlas-batch" name search can group them into a few aggregates.
+        unmatched, names = [], []
         for card_price in card_prices:
             try:
-                if (operation := self.create_update_operation(card_price)):
-                    self.operations.append(operation)
+                if (card := self.find_card_with_set_number(card_price["set_number"])):
+                    self.add_operation(card_price, card, "set_number")
+                else:
+                    names.append(card_price["name"])
+                    unmatched.append(card_price)
             except KeyError as e:
+                metrics.inc("match_outcomes", market=self.market, outcome="invalid")
                 logger.warning(
                     f"card price: {card_price} ---- does not have a key name: {e}")
 
-    def create_update_operation(
-            self, card_price: CardPrice) -> Optional[UpdateOne]:
-        card = self.find_card(card_price)
-        if not card:
-            return None
+        for card_price, card in zip(unmatched, self.find_cards_with_names(names)):
+            self.add_operation(card_price, card, "name", self.check_safe)
+
+    def add_operation(self, card_price: CardPrice, card: Optional[Card], matched_by: str, check_safe: bool = False):
+        outcome = matched_by if card else "miss"
+        try:
+            if card and check_safe:
+                safe_card = self.to_safe(card_price, card)
+                if safe_card is None:
+                    outcome = "unsafe"
+                elif safe_card is not card:
+                    outcome = "token"
+                card = safe_card
+            self.seen.add((card["_id"] if card else None, card_price["id"]))
+            if card:
+                self.queue_operation(card_price, card)
+        except KeyError as e:
+            outcome = "invalid"
+            logger.warning(
+                f"card price: {card_price} ---- does not have a key name: {e}")
 
-        document_id = card["_id"]
+        metrics.inc("match_outcomes", market=self.market, outcome=outcome)
+
+    def sweep(self, mode: str = "mark", complete: bool = True):
+        """
+        Marks ("mark") or removes ("prune") the stored prices of the market that were not seen since
+        the last sweep, the listings that are no longer on the site, with one operation per card.
+        Only a crawl of every page from the first one tells which listings are gone,
+        so after an incomplete or resumed crawl this only forgets the prices that were seen,
+        and so does a crawl that saw less than MIN_SWEEP_SEEN_RATIO of the stored listings.
+        """
+        with self.lock:
+            seen, self.seen = self.seen, set()
+            if mode == "off":
+                return
+            if not complete:
+                logger.info(f"{self.market} - The crawl is incomplete, removed listings are not swept")
+                return
+            if not seen:
+                logger.warning(f"{self.market} - No price was scraped, removed listings are not swept")
+                return
+
+            prices = self.snapshot.get_price_map(self.market)
+            # A listing that did not match this time keeps its stored price
+            unseen = [key for key in prices if key not in seen and (None, key[1]) not in seen]
+            listed = sum(1 for _, _, status in prices.values() if status != REMOVED_STATUS)
+            seen_listed = listed - sum(1 for key in unseen if prices[key][2] != REMOVED_STATUS)
+            if seen_listed < listed * MIN_SWEEP_SEEN_RATIO:
+                logger.warning(f"{self.market} - Only {seen_listed} of the {listed} stored listings were scraped, "
+                               "removed listings are not swept")
+                return
+
+            removed: dict = {}
+            for document_id, id in unseen:
+                if mode == "prune" or prices[(document_id, id)][2] != REMOVED_STATUS:
+                    removed.setdefault(document_id, []).append(id)
+
+            count, now = 0, int(time.time())
+            for document_id, ids in removed.items():
+                self.writer.add(self.create_sweep_operation(document_id, ids, mode, now), document_id)
+                for id in ids:
+                    key = (document_id, id)
+                    if self.history:
+                        self.history.add(PricePoint(card_id=document_id, market=self.market, id=id, price=prices[key][1],
+                                                    status=REMOVED_STATUS, time=now))
+                    if mode == "prune":
+                        del prices[key]
+                    else:
+                        prices[key] = (document_id, prices[key][1], REMOVED_STATUS)
+                count += len(ids)
+
+            self.writer.flush()
+            self.queued = {}
+            if self.history:
+                self.history.flush()
+            metrics.inc("swept_prices", count, market=self.market, mode=mode)
+            logger.info(f"{self.market} - Swept {count} removed listings from {len(removed)} cards ({mode})")
+
+    def update_price_summaries(self, document_ids: list):
+        """
+        Recomputes the "price_summary" of the cards a chunk has just written the prices of.
+        """
+        ids = list(dict.fromkeys(document_ids))
+        self.writer.coll.update_many({"_id": {"$in": ids}}, self.price_summary_pipeline)
+
+    def create_sweep_operation(self, document_id, ids: list[int], mode: str, now: int) -> UpdateOne:
         path = f"card_prices.{self.market}"
-        existing_price = next(
-            (cp for cp in card["card_prices"][self.market] if cp["id"] == card_price["id"]), None)
+        if mode == "prune":
+            return UpdateOne({"_id": document_id}, {"$pull": {path: {"id": {"$in": ids}}}})
+
+        return UpdateOne(
+            {"_id": document_id},
+            {"$set": {f"{path}.$[removed].status": REMOVED_STATUS, f"{path}.$[removed].last_modified": now}},
+            array_filters=[{"removed.id": {"$in": ids}}])
+
+    def queue_operation(self, card_price: CardPrice, card: Card):
+        """
+        Diffs the price against the price map, which holds the prices of the market as they will be
+        once the queued operations are written. A price of the card whose id already has an operation in the chunk
+        being collected replaces that operation, so a listing repeated across pages is written once.
+        Prices are keyed by card and id, as the ids of two listings of different cards can collide.
+        """
+        prices = self.snapshot.get_price_map(self.market)
         card_price.pop("comment", None)
         card_price.pop("name", None)
+        id = card_price["id"]
+        key = (card["_id"], id)
+
+        current = prices.get(key)
+        if key in self.queued:
+            index, previous = self.queued[key]
+            self.writer.replace(index, self.create_update_operation(card_price, card, previous))
+        else:
+            previous = current
+            if (operation := self.create_update_operation(card_price, card, previous)) is None:
+                return
+            self.queued[key] = (len(self.writer.operations), previous)
+            self.writer.add(operation, card["_id"])
+
+        if previous:
+            entry = (previous[0], card_price["price"] or previous[1], card_price["status"])
+        elif card_price["price"]:
+            entry = (card["_id"], card_price["price"], card_price["status"])
+        else:
+            prices.pop(key, None)
+            return
+
+        prices[key] = entry
+        if self.history and entry != current:
+            document_id, price, status = entry
+            self.history.add(PricePoint(card_id=document_id, market=self.market, id=id, price=price,
+                                        status=status, time=card_price["last_modified"]))
+
+    def create_update_operation(
+            self, card_price: CardPrice, card: Card, existing_price: Optional[PriceEntry]) -> Optional[UpdateOne]:
+        path = f"card_prices.{self.market}"
         update = None
 
         if existing_price:
+            document_id, price, status = existing_price
             filter = {"_id": document_id, f"{path}.id": card_price["id"]}
 
-            if card_price["price"] and card_price["price"] != existing_price["price"]:
+            if card_price["price"] and card_price["price"] != price:
                 update = {"$set": {f"{path}.$": card_price}}
-            elif card_price["status"] != existing_price["status"]:
+            elif card_price["status"] != status:
                 update = {
                     "$set": {
                         f"{path}.$.status": card_price["status"],
@@ -74,7 +261,7 @@ class CardPriceUpdater:
                     }
                 }
         elif card_price["price"]:
-            filter = {"_id": document_id}
+            filter = {"_id": card["_id"]}
             update = {"$addToSet": {path: card_price}}
 
         if update:
@@ -82,27 +269,38 @@ class CardPriceUpdater:
 
         return None
 
-    def find_card(self, card_price: CardPrice) -> Optional[Card]:
-        name_pipeline = [create_name_filter(
-            f"{self.card_language}", card_price["name"])]
+    def find_card_with_set_number(self, set_number: str) -> Optional[Card]:
+        return self.snapshot.get_set_index(self.set_locale).find(set_number)
 
-        if (card := self.find_card_with_set_number(card_price["set_number"])):
-            return card
-        if (card := next(self.coll.aggregate(name_pipeline), None)):
-            if self.check_safe:
-                return self.to_safe(card_price, card)
-            return card
+    def find_cards_with_names(self, names: list[str]) -> list[Optional[Card]]:
+        if not names:
+            return []
 
-        return None
+        if self.name_search.method == "atlas":
+            return [next(self.coll.aggregate([create_name_filter(f"{self.card_language}", name)]), None) for name in names]
 
-    """
-	Honestly, I can't think of a way to do the same thing as
-	this function but with a MongoDB query
-	"""
+        if self.name_search.method == "atlas-batch":
+            unique_names = list(dict.fromkeys(names))
+            batch_size = self.name_search.batch_size
+            batches = [unique_names[i:i + batch_size] for i in range(0, len(unique_names), batch_size)]
+            with ThreadPoolExecutor(max_workers=self.name_search.batch_concurrency) as pool:
+                cards = {}
+                for batch_cards in pool.map(self.find_cards_with_name_batch, batches):
+                    cards.update(batch_cards)
 
-    def find_card_with_set_number(self, set_number: str) -> Optional[Card]:
-        return next(
-            (card for card in self.all_cards for set in card["sets"][self.set_locale] if set["set_number"] in set_number), None)
+            return [cards.get(name) for name in names]
+
+        name_index = self.snapshot.get_name_index(self.card_language)
+        return [name_index.find(name) for name in names]
+
+    def find_cards_with_name_batch(self, names: list[str]) -> dict[str, Card]:
+        pipeline = create_batch_name_pipeline(self.coll.name, f"{self.card_language}", names)
+        cards = {}
+        for result in self.coll.aggregate(pipeline):
+            if (card := self.snapshot.get_card(result["_id"])):
+                cards[names[result["query_index"]]] = card
+
+        return cards
 
     def to_safe(self, card_price: CardPrice, card: Card) -> Optional[Card]:
         if self.is_token(card_price, card):
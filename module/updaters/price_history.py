@@ -0,0 +1,100 @@
+from dataclasses import replace
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Optional
+
+from pymongo import ASCENDING, InsertOne
+from pymongo.database import Database
+
+from ..utils.card import PricePoint
+from ..utils.config import WriteConfig
+from ..utils.logger import setup_logger
+from .bulk_writer import BulkWriter
+
+logger = setup_logger("price history", "logs/price_history.log")
+
+"""
+Points are stored with one-letter fields and with integer codes for the market and status,
+as a time-series collection keeps every field of every point:
+    t: the time of the change, m: {c: the card "_id", k: the market code, i: the CardPrice id},
+    p: the price, s: the status code
+"""
+MARKET_CODES = {"bigweb": 0, "yuyutei": 1, "tcg_corner": 2}
+STATUS_CODES = {"For Sale": 0, "Sold Out": 1, "Removed": 2}
+MARKETS_BY_CODE = {code: market for market, code in MARKET_CODES.items()}
+STATUSES_BY_CODE = {code: status for status, code in STATUS_CODES.items()}
+
+
+class PriceHistory:
+    """
+    An append-only time-series collection with a point for every change of a card price,
+    queued by the CardPriceUpdater of every market from the same diff as its writes.
+    The collection (MongoDB 5.0+) and its index are created before the first point is written.
+    """
+
+    def __init__(self, db: Database, name: str, config: Optional[WriteConfig] = None):
+        self.db = db
+        self.coll = db[name]
+        # Points are written by the updater that adds the point filling a chunk
+        self.writer = BulkWriter(self.coll, "price_history", replace(config or WriteConfig(), background=False))
+        self.created = False
+        # Points are added by the updaters of every market, from their worker threads
+        self.lock = Lock()
+
+    def create_collection(self):
+        if self.coll.name not in self.db.list_collection_names():
+            self.db.create_collection(self.coll.name, timeseries={"timeField": "t", "metaField": "m", "granularity": "hours"})
+            logger.info(f"Created the time-series collection {self.coll.name}")
+
+        # Serves the range queries of a card, of one of its markets and of one of its prices
+        self.coll.create_index([("m.c", ASCENDING), ("m.k", ASCENDING), ("m.i", ASCENDING), ("t", ASCENDING)])
+        self.created = True
+
+    def add(self, point: PricePoint):
+        document = {
+            "t": datetime.fromtimestamp(point["time"], timezone.utc),
+            "m": {"c": point["card_id"], "k": MARKET_CODES[point["market"]], "i": point["id"]},
+            "p": point["price"],
+            "s": STATUS_CODES.get(point["status"], -1),
+        }
+        with self.lock:
+            if not self.created:
+                self.create_collection()
+            self.writer.add(InsertOne(document))
+            self.writer.submit_if_full()
+
+    def flush(self):
+        with self.lock:
+            self.writer.flush()
+
+    def find(self, card_id, market: Optional[str] = None, id: Optional[int] = None,
+             between: tuple[Optional[int], Optional[int]] = (None, None)) -> list[PricePoint]:
+        """
+        The points of a card between a start (included) and an end (excluded), as timestamps,
+        optionally of one market and one of its prices, oldest first.
+        A price id is only unique within a market, so "id" needs "market".
+        """
+        start, end = between
+        filter: dict = {"m.c": card_id}
+        if market:
+            filter["m.k"] = MARKET_CODES[market]
+            if id is not None:
+                filter["m.i"] = id
+        if start is not None or end is not None:
+            filter["t"] = {}
+            if start is not None:
+                filter["t"]["$gte"] = datetime.fromtimestamp(start, timezone.utc)
+            if end is not None:
+                filter["t"]["$lt"] = datetime.fromtimestamp(end, timezone.utc)
+
+        return [
+            PricePoint(
+                card_id=point["m"]["c"],
+                market=MARKETS_BY_CODE[point["m"]["k"]],
+                id=point["m"]["i"],
+                price=point["p"],
+                status=STATUSES_BY_CODE.get(point["s"], ""),
+                time=int(point["t"].replace(tzinfo=timezone.utc).timestamp())
+            )
+            for point in self.coll.find(filter, {"_id": 0}).sort("t", ASCENDING)
+        ]
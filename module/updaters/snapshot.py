@@ -0,0 +1,95 @@
+from threading import Lock
+from typing import Any, Optional
+
+from pymongo.collection import Collection
+
+from ..utils.card import Card
+from ..utils.logger import setup_logger
+from ..utils.name_index import NameIndex
+from ..utils.set_index import SetNumberIndex
+
+logger = setup_logger("card snapshot", "logs/card_snapshot.log")
+
+# The "_id" of the card a price is stored in, its price and its status
+PriceEntry = tuple[Any, int, str]
+# The "_id" of the card a price is stored in and the price id, which is only unique within a card
+# as the ids of Yuyutei and TCG Corner are hashes of the set number and rarity (see id_from_info)
+PriceKey = tuple[Any, int]
+
+
+class CardSnapshot:
+    """
+    A read-only copy of the card collection shared by every CardPriceUpdater.
+    It is loaded the first time an updater needs it, with only the fields used
+    for matching, and is reloaded only after CardUpdater has written.
+    """
+
+    def __init__(self, coll: Collection[Card], markets: list[str]):
+        self.coll = coll
+        self.projection = {"_id": 1, "sets": 1, "name": 1, "konami_id": 1}
+        for market in markets:
+            for field in ["id", "price", "status"]:
+                self.projection[f"card_prices.{market}.{field}"] = 1
+
+        # CardPriceUpdater instances run in worker threads
+        self.lock = Lock()
+        self.cards: Optional[list[Card]] = None
+        self.cards_by_id: dict = {}
+        self.set_indexes: dict[str, SetNumberIndex] = {}
+        self.name_indexes: dict[str, NameIndex] = {}
+        self.price_maps: dict[str, dict[PriceKey, PriceEntry]] = {}
+
+    def get_cards(self) -> list[Card]:
+        with self.lock:
+            return self.load()
+
+    def get_card(self, id) -> Optional[Card]:
+        with self.lock:
+            self.load()
+            return self.cards_by_id.get(id)
+
+    def get_set_index(self, locale: str) -> SetNumberIndex:
+        with self.lock:
+            if locale not in self.set_indexes:
+                self.set_indexes[locale] = SetNumberIndex(self.load(), locale)
+
+            return self.set_indexes[locale]
+
+    def get_name_index(self, language: str) -> NameIndex:
+        with self.lock:
+            if language not in self.name_indexes:
+                self.name_indexes[language] = NameIndex(self.load(), language)
+
+            return self.name_indexes[language]
+
+    def get_price_map(self, market: str) -> dict[PriceKey, PriceEntry]:
+        """
+        The prices of a market by card and id. It belongs to the CardPriceUpdater of that market,
+        which keeps it up to date with the operations it queues, so that it does not go stale
+        as the run's own writes land. It is rebuilt after CardUpdater has written.
+        """
+        with self.lock:
+            if market not in self.price_maps:
+                price_map = {}
+                for card in self.load():
+                    for card_price in card.get("card_prices", {}).get(market, []):
+                        price_map.setdefault((card["_id"], card_price["id"]), (card["_id"], card_price.get("price"), card_price.get("status")))
+                self.price_maps[market] = price_map
+
+            return self.price_maps[market]
+
+    def invalidate(self):
+        with self.lock:
+            self.cards = None
+            self.cards_by_id = {}
+            self.set_indexes = {}
+            self.name_indexes = {}
+            self.price_maps = {}
+
+    def load(self) -> list[Card]:
+        if self.cards is None:
+            self.cards = list(self.coll.find({}, self.projection))
+            self.cards_by_id = {card["_id"]: card for card in self.cards}
+            logger.info(f"Loaded {len(self.cards)} cards into the snapshot")
+
+        return self.cards
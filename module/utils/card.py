@@ -1,4 +1,4 @@
-from typing import TypedDict
+from typing import Optional, TypedDict
 
 
 class CardPrice(TypedDict):
@@ -19,6 +19,32 @@ class CardPrices(TypedDict):
     tcg_corner: list[CardPrice]
 
 
+MARKETS = ["bigweb", "yuyutei", "tcg_corner"]
+
+
+class MarketSummary(TypedDict):
+    min: Optional[int]  # The lowest "For Sale" price
+    in_stock: int  # The number of "For Sale" prices
+
+
+class CheapestPrice(CardPrice):
+    market: str
+
+
+class PriceSummary(TypedDict, total=False):
+    """
+    Recomputed from "card_prices" whenever the prices of the card are written.
+    "cheapest" is missing when no price is "For Sale".
+    """
+    bigweb: MarketSummary
+    yuyutei: MarketSummary
+    tcg_corner: MarketSummary
+    min: Optional[int]
+    in_stock: int
+    last_modified: Optional[int]  # The last time one of the prices changed
+    cheapest: CheapestPrice
+
+
 class Name(TypedDict):
     en: str
     ja: str
@@ -39,6 +65,38 @@ class Card(TypedDict):
     password: int
     sets: Sets
     card_prices: CardPrices
+    price_summary: PriceSummary
+    content_hash: str  # Hash of the card information, to only write the cards that changed
+
+
+class PricePoint(TypedDict):
+    card_id: object  # The "_id" of the card the price is stored in
+    market: str
+    id: int
+    price: int
+    status: str
+    time: int
+
+
+"""
+A CardPrice without "last_modified" (and "comment"), with its fields in the same order.
+The parse workers return these as they are much cheaper to pickle than dicts.
+"""
+CardPriceTuple = tuple[int, int, str, str, str, str, str]
+
+
+def card_price_from_tuple(card_price: CardPriceTuple, last_modified: int) -> CardPrice:
+    id, price, name, set_number, rarity, condition, status = card_price
+    return CardPrice(
+        id=id,
+        price=price,
+        name=name,
+        set_number=set_number,
+        rarity=rarity,
+        condition=condition,
+        status=status,
+        last_modified=last_modified
+    )
 
 
 def id_from_info(info: str) -> int:
@@ -0,0 +1,45 @@
+import json
+import os
+from threading import Lock
+from typing import Optional
+
+
+class CheckpointStore:
+    """
+    Remembers where every price scraper stopped (the next page, its URL and Referer)
+    in a JSON file, so that an interrupted run can be resumed with --resume.
+    """
+
+    def __init__(self, path: str = "checkpoints.json"):
+        self.path = path
+        # Scrapers are run in worker threads
+        self.lock = Lock()
+
+    def load(self, key: str) -> Optional[dict]:
+        with self.lock:
+            return self.read().get(key)
+
+    def save(self, key: str, state: dict):
+        with self.lock:
+            checkpoints = self.read()
+            checkpoints[key] = state
+            self.write(checkpoints)
+
+    def clear(self, key: str):
+        with self.lock:
+            checkpoints = self.read()
+            if checkpoints.pop(key, None) is not None:
+                self.write(checkpoints)
+
+    def read(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def write(self, checkpoints: dict):
+        # Write to a temporary file first so that a crash never leaves a truncated checkpoint file
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(checkpoints, f, ensure_ascii=False, indent=4)
+        os.replace(f"{self.path}.tmp", self.path)
@@ -0,0 +1,51 @@
+"""
+The options of the Executor and its updaters, set from the command line in main.py.
+"""
+from dataclasses import dataclass, field
+from typing import Optional
+
+from pymongo import WriteConcern
+
+
+@dataclass
+class WriteConfig:
+    """
+    How an updater writes its operations, see BulkWriter.
+    """
+    flush_size: int = 1000
+    background: bool = False
+    # A number of members or a tag like "majority", the collection's write concern by default
+    write_concern: Optional[str] = None
+    # Set by the updaters whose operations of a chunk depend on each other
+    ordered: bool = False
+
+    def get_write_concern(self) -> Optional[WriteConcern]:
+        if not self.write_concern:
+            return None
+
+        return WriteConcern(w=int(self.write_concern) if self.write_concern.isdigit() else self.write_concern)
+
+
+@dataclass
+class NameSearchConfig:
+    """
+    "local" matches names against the snapshot, "atlas" runs the $search aggregate for each price
+    and "atlas-batch" resolves "batch_size" names per aggregate, "batch_concurrency" aggregates at a time.
+    """
+    method: str = "local"
+    batch_size: int = 50
+    batch_concurrency: int = 4
+
+
+@dataclass
+class Config:
+    name_search: NameSearchConfig = field(default_factory=NameSearchConfig)
+    write: WriteConfig = field(default_factory=WriteConfig)
+    bigweb_concurrency: int = 1
+    # Requests per second sent to Bigweb, see HOST_RATE_LIMITS in fetch.py by default
+    bigweb_rate: Optional[float] = None
+    parse_workers: int = 2
+    # What happens to the prices of listings that are gone after a complete crawl: "mark", "prune" or "off"
+    sweep: str = "mark"
+    # Every change of a card price is also appended to the "<coll>_history" time-series collection
+    price_history: bool = False
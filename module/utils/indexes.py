@@ -0,0 +1,116 @@
+"""
+The indexes the updaters and the price queries rely on, created at startup so that none of
+their queries scans the collection on a self-hosted MongoDB (Atlas Search indexes are managed in Atlas).
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+
+from .card import MARKETS, Card
+from .logger import setup_logger
+
+logger = setup_logger("indexes", "logs/indexes.log")
+
+REQUIRED_INDEXES = [
+    # CardUpdater upserts cards by konami_id, or by English name for cards without one
+    IndexModel([("konami_id", ASCENDING)], name="konami_id_1"),
+    IndexModel([("name.en", ASCENDING)], name="name.en_1"),
+    # The CardPriceUpdaters find a stored price from the price map of the snapshot, their updates filter on "_id"
+    # find_cheapest_cards
+    IndexModel([("price_summary.min", ASCENDING)], name="price_summary.min_1"),
+]
+
+# How long the accesses of an index are counted before it can be reported as unused
+MIN_UNUSED_AGE = timedelta(days=1)
+
+"""
+A sample of every query the updaters run for every card or price, with the index it should use.
+set_card_prices_field and fill_price_summaries are left out, they only run once per process.
+"""
+UPDATER_QUERIES = {
+    "CardUpdater by konami_id": ({"konami_id": 1}, "konami_id_1"),
+    "CardUpdater by name": ({"name.en": ""}, "name.en_1"),
+    **{f"CardPriceUpdater {market} price update": ({"_id": 0, f"card_prices.{market}.id": 0}, "_id_") for market in MARKETS},
+    "find_cheapest_cards": ({"price_summary.min": {"$gt": 0}}, "price_summary.min_1"),
+}
+
+
+def ensure_indexes(coll: Collection[Card]) -> list[str]:
+    """
+    Creates the required indexes that do not exist yet, and returns their names.
+    """
+    existing = set(coll.index_information())
+    missing = [index for index in REQUIRED_INDEXES if index.document["name"] not in existing]
+    if not missing:
+        return []
+
+    created = coll.create_indexes(missing)
+    logger.info(f"Created the indexes {', '.join(created)}")
+    return created
+
+
+def report_indexes(coll: Collection[Card], created: Optional[list[str]] = None) -> dict[str, list[str]]:
+    """
+    The required indexes that are missing, the indexes that are not required,
+    and the indexes that have not been used since the server started or since they were created
+    ($indexStats, which needs the clusterMonitor role on Atlas; they are not reported without it).
+    The indexes in "created" and the ones counted for less than MIN_UNUSED_AGE are not reported as unused,
+    as nothing had the time to use them.
+    """
+    existing = set(coll.index_information())
+    required = {index.document["name"] for index in REQUIRED_INDEXES} | {"_id_"}
+    report = {"missing": sorted(required - existing), "unknown": sorted(existing - required), "unused": []}
+
+    try:
+        counted_since = datetime.now(timezone.utc) - MIN_UNUSED_AGE
+        report["unused"] = sorted(
+            stats["name"] for stats in coll.aggregate([{"$indexStats": {}}])
+            if stats["accesses"]["ops"] == 0 and stats["name"] not in (created or [])
+            and stats["accesses"]["since"].replace(tzinfo=timezone.utc) < counted_since)
+    except OperationFailure as e:
+        logger.warning(f"Could not read the index statistics: {e}")
+
+    for kind, names in report.items():
+        if names:
+            logger.warning(f"{kind.capitalize()} indexes: {', '.join(names)}")
+
+    return report
+
+
+def explain_queries(coll: Collection[Card]) -> dict[str, dict]:
+    """
+    Explains every updater query, and whether its winning plan scans the index it should use.
+    """
+    results = {}
+    for name, (filter, index) in UPDATER_QUERIES.items():
+        stages, indexes = [], []
+        collect_plan(coll.find(filter).explain()["queryPlanner"]["winningPlan"], stages, indexes)
+        results[name] = {"stages": stages, "indexes": indexes, "uses_index": index in indexes}
+        if index not in indexes:
+            logger.warning(f"{name} does not use the index {index}: {' > '.join(stages)}")
+
+    return results
+
+
+def collect_plan(plan: Any, stages: list[str], indexes: list[str]):
+    """
+    Collects the stages and the index names of a plan, from the root to the leaves.
+    The plans of the slot based engine (MongoDB 7.0+) are nested under "queryPlan",
+    and the lookups by "_id" do not name their index.
+    """
+    if isinstance(plan, list):
+        for child in plan:
+            collect_plan(child, stages, indexes)
+    elif isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "indexName" in plan:
+            indexes.append(plan["indexName"])
+        elif plan.get("stage") in ["IDHACK", "EXPRESS_IDHACK"]:
+            indexes.append("_id_")
+        for key in ["queryPlan", "inputStage", "inputStages"]:
+            if key in plan:
+                collect_plan(plan[key], stages, indexes)
@@ -0,0 +1,62 @@
+import codecs
+import json
+from typing import Any, AsyncIterator
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Yields the objects of a top-level UTF-8 JSON array one at a time while its bytes
+    are still arriving, so that only one object has to be held in memory.
+    The chunks are always read to the end, as a cache may be written while they are read.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    finished = False
+
+    async for chunk in chunks:
+        if finished:
+            continue
+
+        buffer += text_decoder.decode(chunk)
+        position = 0
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position >= len(buffer):
+                break
+
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("The JSON document is not an array")
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == "]":
+                finished = True
+                break
+
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The element is not complete yet
+                break
+
+            # A number or a literal cut by the end of a chunk decodes too ("12" of "12345", "-1" of "-1.5"),
+            # so an element is only complete once the "," or "]" after it has arrived
+            next_position = end
+            while next_position < len(buffer) and buffer[next_position] in " \t\r\n":
+                next_position += 1
+            if next_position >= len(buffer) or buffer[next_position] not in ",]":
+                break
+
+            position = end
+            yield element
+
+        buffer = buffer[position:]
+
+    if not finished:
+        raise ValueError("The JSON array ended early")
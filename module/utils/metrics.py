@@ -0,0 +1,157 @@
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Iterator
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000)
+
+"""
+What every metric measures, also used as the HELP line of the Prometheus export.
+Counters are exported with a "_total" suffix.
+"""
+DESCRIPTIONS = {
+    "fetch_seconds": "Duration of every request sent by the fetcher (until the headers for streamed bodies), by host",
+    "fetch_requests": "Requests sent by the fetcher, by host and outcome (ok, not_modified or error)",
+    "fetch_retries": "Requests sent again after a failure, by host",
+    "fetch_sleep_seconds": "Time spent waiting before sending requests, by host and reason (rate_limit or backoff)",
+    "scrape_pages": "Pages yielded by every price scraper",
+    "scrape_seconds": "Time spent by every price scraper, from its first request to its last write",
+    "match_seconds": "Duration of CardPriceUpdater.add for every page, by market",
+    "match_outcomes": "Card prices by market and by how they were matched: set_number, name, token "
+                      "(moved to the token card), unsafe (rejected), miss or invalid",
+    "swept_prices": "Stored prices whose listing was not seen by a complete crawl, by market and mode (mark or prune)",
+    "bulk_write_operations": "Number of operations of every bulk_write, by updater",
+    "bulk_write_seconds": "Duration of every bulk_write, by updater",
+    "bulk_write_documents": "Documents matched, modified and upserted by the bulk_writes, by updater",
+}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative_counts(self) -> list[int]:
+        counts, total = [], 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+
+        return counts
+
+
+class Metrics:
+    """
+    Counters and histograms of a run, labelled like Prometheus metrics.
+    They are updated from the event loop and from worker threads, hence the lock.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time.time()
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.histograms: dict[str, dict[tuple, Histogram]] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, buckets: tuple = SECONDS_BUCKETS, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            histograms = self.histograms.setdefault(name, {})
+            if key not in histograms:
+                histograms[key] = Histogram(buckets)
+            histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+
+    def to_report(self) -> dict:
+        with self.lock:
+            return {
+                "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                "duration_seconds": round(time.time() - self.started, 3),
+                "counters": {
+                    name: [{"labels": dict(key), "value": round(value, 6)} for key, value in values.items()]
+                    for name, values in self.counters.items()
+                },
+                "histograms": {
+                    name: [{
+                        "labels": dict(key),
+                        "count": histogram.count,
+                        "sum": round(histogram.sum, 6),
+                        "buckets": {str(bound): count for bound, count in zip(histogram.buckets, histogram.cumulative_counts())}
+                    } for key, histogram in histograms.items()]
+                    for name, histograms in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self, prefix: str = "dotscaper") -> str:
+        lines = []
+        with self.lock:
+            for name, values in self.counters.items():
+                metric = f"{prefix}_{name}_total"
+                lines += [f"# HELP {metric} {DESCRIPTIONS.get(name, name)}", f"# TYPE {metric} counter"]
+                lines += [f"{metric}{format_labels(dict(key))} {value}" for key, value in values.items()]
+
+            for name, histograms in self.histograms.items():
+                metric = f"{prefix}_{name}"
+                lines += [f"# HELP {metric} {DESCRIPTIONS.get(name, name)}", f"# TYPE {metric} histogram"]
+                for key, histogram in histograms.items():
+                    labels = dict(key)
+                    for bound, count in zip(histogram.buckets, histogram.cumulative_counts()):
+                        lines.append(f"{metric}_bucket{format_labels(labels | {'le': str(bound)})} {count}")
+                    lines.append(f"{metric}_bucket{format_labels(labels | {'le': '+Inf'})} {histogram.count}")
+                    lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_report(), f, ensure_ascii=False, indent=4)
+
+    def write_prometheus(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+# Shared by the whole run, like the loggers
+metrics = Metrics()
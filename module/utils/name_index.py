@@ -0,0 +1,135 @@
+import math
+import unicodedata
+from typing import Optional
+
+from .card import Card
+from .string_manip import half_to_full
+
+
+def tokenize(string: str) -> list[str]:
+    """
+    An approximation of the lucene.standard analyzer used by the "name_search" index:
+    runs of letters, digits and katakana are words, every other CJK character is a word
+    on its own, everything else separates words, and words are lowercased.
+    """
+    tokens = []
+    word = ""
+    word_is_katakana = False
+
+    for char in half_to_full(string).lower():
+        category = unicodedata.category(char)
+        name = unicodedata.name(char, "")
+        is_katakana = "KATAKANA" in name and char != "・"
+        is_ideograph = "CJK" in name or "HIRAGANA" in name
+
+        if is_ideograph and not is_katakana:
+            if word:
+                tokens.append(word)
+            tokens.append(char)
+            word = ""
+        elif category[0] in "LN" or is_katakana:
+            if word and is_katakana != word_is_katakana:
+                tokens.append(word)
+                word = ""
+            word += char
+            word_is_katakana = is_katakana
+        elif word:
+            tokens.append(word)
+            word = ""
+
+    if word:
+        tokens.append(word)
+
+    return tokens
+
+
+def deletions(token: str) -> set[str]:
+    return {token} | {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def edit_distance_is_one(a: str, b: str) -> bool:
+    """
+    Damerau (optimal string alignment) distance of exactly one,
+    which is what Lucene's FuzzyQuery allows with maxEdits: 1.
+    """
+    if a == b or abs(len(a) - len(b)) > 1:
+        return False
+
+    if len(a) > len(b):
+        a, b = b, a
+
+    start = 0
+    while start < len(a) and a[start] == b[start]:
+        start += 1
+
+    if len(a) != len(b):
+        return a[start:] == b[start + 1:]
+
+    if a[start + 1:] == b[start + 1:]:
+        return True
+
+    return (start + 1 < len(a) and a[start] == b[start + 1] and
+            a[start + 1] == b[start] and a[start + 2:] == b[start + 2:])
+
+
+class NameIndex:
+    """
+    Local replacement for the Atlas $search text query with fuzzy maxEdits: 1.
+    Every query term is expanded to the indexed terms within one edit, each expansion
+    is scored with BM25 and boosted like Lucene's fuzzy terms (1 - edits / length),
+    and the card with the highest total score wins, ties going to collection order.
+    """
+
+    k1 = 1.2
+    b = 0.75
+    max_expansions = 50
+
+    def __init__(self, cards: list[Card], language: str):
+        self.cards = cards
+        self.postings: dict[str, dict[int, int]] = {}
+        self.lengths: list[int] = []
+
+        for position, card in enumerate(cards):
+            tokens = tokenize(card["name"].get(language) or "")
+            self.lengths.append(len(tokens))
+            for token in tokens:
+                frequencies = self.postings.setdefault(token, {})
+                frequencies[position] = frequencies.get(position, 0) + 1
+
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        self.neighbours: dict[str, list[str]] = {}
+        for token in self.postings:
+            for deletion in deletions(token):
+                self.neighbours.setdefault(deletion, []).append(token)
+
+    def find(self, name: str) -> Optional[Card]:
+        scores: dict[int, float] = {}
+        for token in tokenize(name):
+            for term, boost in self.expand(token):
+                idf = self.idf(term)
+                for position, frequency in self.postings[term].items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / self.average_length)
+                    score = boost * idf * frequency * (self.k1 + 1) / (frequency + norm)
+                    scores[position] = scores.get(position, 0) + score
+
+        if not scores:
+            return None
+
+        best = min(scores, key=lambda position: (-scores[position], position))
+        return self.cards[best]
+
+    def expand(self, token: str) -> list[tuple[str, float]]:
+        terms = [(token, 1.0)] if token in self.postings else []
+        if len(token) <= 1:
+            return terms
+
+        candidates = {candidate for deletion in deletions(token) for candidate in self.neighbours.get(deletion, [])}
+        fuzzy = sorted(candidate for candidate in candidates if edit_distance_is_one(token, candidate))
+        for candidate in fuzzy[:self.max_expansions]:
+            terms.append((candidate, 1 - 1 / min(len(token), len(candidate))))
+
+        return terms
+
+    def idf(self, term: str) -> float:
+        frequency = len(self.postings[term])
+        return math.log(1 + (len(self.lengths) - frequency + 0.5) / (frequency + 0.5))
@@ -0,0 +1,29 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+import trio
+
+
+class ParsePool:
+    """
+    Parses the fetched pages in worker processes, so that parsing neither blocks the event loop
+    nor holds the GIL shared with the fetching and matching of every market.
+    With no workers, the pages are parsed in a worker thread instead.
+    The functions and their arguments are pickled, so they have to be defined at module level.
+    """
+
+    def __init__(self, workers: int = 2):
+        # Forking a process that runs threads is unsafe, the workers are started lazily on the first page
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) if workers > 0 else None
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        if not self.executor:
+            return await trio.to_thread.run_sync(fn, *args)
+
+        future = self.executor.submit(fn, *args)
+        return await trio.to_thread.run_sync(future.result)
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
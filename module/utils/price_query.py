@@ -0,0 +1,54 @@
+"""
+Queries for the consumers of the collection (like Kitt), answered from the "price_summary"
+that the CardPriceUpdaters keep on every card instead of scanning its "card_prices".
+"""
+from typing import Optional
+
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+
+from .card import MARKETS, Card, CheapestPrice, PriceSummary
+from .query import create_price_summary_pipeline
+
+
+def fill_price_summaries(coll: Collection[Card]):
+    """
+    Computes the "price_summary" of the cards that have prices but no summary yet,
+    the summaries are then kept up to date by the CardPriceUpdaters.
+    """
+    coll.update_many({"card_prices": {"$exists": True}, "price_summary": {"$exists": False}}, create_price_summary_pipeline(MARKETS))
+
+
+def create_card_filter(konami_id: Optional[int] = None, name: Optional[str] = None) -> dict:
+    # Both are indexed (see REQUIRED_INDEXES)
+    if konami_id is not None:
+        return {"konami_id": konami_id}
+    if name is not None:
+        return {"name.en": name}
+
+    raise ValueError("A konami_id or a name is needed to find a card")
+
+
+def find_price_summary(coll: Collection[Card], konami_id: Optional[int] = None, name: Optional[str] = None) -> Optional[PriceSummary]:
+    card = coll.find_one(create_card_filter(konami_id, name), {"_id": 0, "price_summary": 1})
+    return card.get("price_summary") if card else None
+
+
+def find_cheapest(coll: Collection[Card], konami_id: Optional[int] = None, name: Optional[str] = None) -> Optional[CheapestPrice]:
+    """
+    The cheapest "For Sale" price of a card across every market, with its market.
+    """
+    card = coll.find_one(create_card_filter(konami_id, name), {"_id": 0, "price_summary.cheapest": 1})
+    return card.get("price_summary", {}).get("cheapest") if card else None
+
+
+def find_cheapest_cards(coll: Collection[Card], limit: int = 20, max_price: Optional[int] = None) -> list[Card]:
+    """
+    The cards with a "For Sale" price, cheapest first, without their "card_prices".
+    """
+    filter = {"price_summary.min": {"$gt": 0}}
+    if max_price is not None:
+        filter["price_summary.min"]["$lte"] = max_price
+
+    projection = {"card_prices": 0, "content_hash": 0}
+    return list(coll.find(filter, projection).sort("price_summary.min", ASCENDING).limit(limit))
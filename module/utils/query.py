@@ -12,3 +12,77 @@ def create_name_filter(language: str, query: str) -> dict:
             }
         }
     }
+
+
+def create_batch_name_pipeline(coll_name: str, language: str, queries: list[str]) -> list[dict]:
+    """
+    $search has to be the first stage of a pipeline and is not allowed in $facet,
+    so every query gets its own $unionWith sub-pipeline (MongoDB 6.0+) that returns
+    the _id of its top-1 result tagged with the position of the query.
+    """
+    def sub_pipeline(query_index: int, query: str) -> list[dict]:
+        return [
+            create_name_filter(language, query),
+            {"$limit": 1},
+            {"$project": {"_id": 1}},
+            {"$set": {"query_index": query_index}}
+        ]
+
+    pipeline = sub_pipeline(0, queries[0])
+    for query_index, query in enumerate(queries[1:], 1):
+        pipeline.append({"$unionWith": {"coll": coll_name, "pipeline": sub_pipeline(query_index, query)}})
+
+    return pipeline
+
+
+def create_price_summary_pipeline(markets: list[str]) -> list[dict]:
+    """
+    An update pipeline (MongoDB 4.2+) that recomputes "price_summary" from the "card_prices" of a card:
+    the lowest "For Sale" price and the number of them for every market and for all of them,
+    the cheapest "For Sale" price with its market, and the last time one of the prices changed.
+    """
+    def for_sale(market: str) -> dict:
+        return {
+            "$filter": {
+                "input": {"$ifNull": [f"$card_prices.{market}", []]},
+                "as": "price",
+                "cond": {"$eq": ["$$price.status", "For Sale"]}
+            }
+        }
+
+    summary = {}
+    for market in markets:
+        summary[f"price_summary.{market}.min"] = {"$min": {"$map": {"input": for_sale(market), "as": "price", "in": "$$price.price"}}}
+        summary[f"price_summary.{market}.in_stock"] = {"$size": for_sale(market)}
+
+    all_for_sale = {
+        "$concatArrays": [
+            {"$map": {"input": for_sale(market), "as": "price", "in": {"$mergeObjects": ["$$price", {"market": market}]}}}
+            for market in markets
+        ]
+    }
+
+    cheapest = {"$filter": {"input": all_for_sale, "as": "price", "cond": {"$eq": ["$$price.price", "$price_summary.min"]}}}
+
+    return [
+        {"$set": summary},
+        {
+            "$set": {
+                # $min and $max ignore the markets without prices
+                "price_summary.min": {"$min": [f"$price_summary.{market}.min" for market in markets]},
+                "price_summary.in_stock": {"$add": [f"$price_summary.{market}.in_stock" for market in markets]},
+                "price_summary.last_modified": {"$max": [{"$max": f"$card_prices.{market}.last_modified"} for market in markets]},
+            }
+        },
+        {
+            "$set": {
+                "price_summary.cheapest": {
+                    "$cond": [
+                        {"$eq": ["$price_summary.min", None]},
+                        "$$REMOVE",
+                        {"$arrayElemAt": [cheapest, 0]}
+                    ]
+                }
+            }
+        }
+    ]
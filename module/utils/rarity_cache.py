@@ -0,0 +1,40 @@
+import sqlite3
+import time
+from typing import Optional
+
+
+class RarityCache:
+    """
+    Rarities read from TCG Corner product pages, keyed by the product href and kept
+    in a SQLite file for "ttl" seconds, so that known products skip both the request
+    and the wait on later runs.
+    """
+
+    def __init__(self, path: str = "rarity_cache.sqlite3", ttl: int = 30 * 24 * 60 * 60):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rarities (href TEXT PRIMARY KEY, rarity TEXT NOT NULL, updated INTEGER NOT NULL)")
+        self.connection.commit()
+
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, href: str) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT rarity FROM rarities WHERE href = ? AND updated >= ?", (href, int(time.time()) - self.ttl)).fetchone()
+        if row:
+            self.hits += 1
+            return row[0]
+
+        self.misses += 1
+        return None
+
+    def set(self, href: str, rarity: str):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO rarities (href, rarity, updated) VALUES (?, ?, ?)", (href, rarity, int(time.time())))
+        self.connection.commit()
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,36 @@
+from typing import Optional
+
+from .card import Card
+
+
+class SetNumberIndex:  # pylint: disable=too-few-public-methods
+    """
+    A set number matches a card price when it is a substring of the scraped
+    set number (e.g. "RC04-JP001" in "RC04-JP001 (Scratch)"), and the first card
+    in collection order wins. Instead of scanning every set of every card, we map
+    each set number to the position of the first card that has it, then look up
+    the substrings of the scraped set number whose length is one of the known lengths.
+    """
+
+    def __init__(self, cards: list[Card], locale: str):
+        self.cards = cards
+        self.positions: dict[str, int] = {}
+
+        for position, card in enumerate(cards):
+            for set in card["sets"].get(locale, []):
+                self.positions.setdefault(set["set_number"], position)
+
+        self.lengths = sorted({len(set_number) for set_number in self.positions})
+
+    def find(self, set_number: str) -> Optional[Card]:
+        best = None
+        for length in self.lengths:
+            if length > len(set_number):
+                break
+
+            for start in range(len(set_number) - length + 1):
+                position = self.positions.get(set_number[start:start + length])
+                if position is not None and (best is None or position < best):
+                    best = position
+
+        return None if best is None else self.cards[best]
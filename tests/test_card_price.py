@@ -0,0 +1,61 @@
+from benchmarks.fake_collection import FakeCollection
+from module.updaters.card_price import CardPriceUpdater
+from module.updaters.snapshot import CardSnapshot
+from module.utils.card import MARKETS
+
+
+def create_card(id: int, set_number: str, stored_prices: list) -> dict:
+    return {
+        "_id": id, "konami_id": id, "name": {"en": f"Card {id}", "ja": f"カード{id}"},
+        "sets": {"ja": [{"set_number": set_number}], "ae": []},
+        "card_prices": {market: stored_prices if market == "yuyutei" else [] for market in MARKETS},
+    }
+
+
+def create_card_price(id: int, price: int, set_number: str) -> dict:
+    return {"id": id, "price": price, "name": "", "set_number": set_number, "rarity": "N",
+            "condition": "Good", "status": "For Sale", "last_modified": 1}
+
+
+def create_updater(cards: list[dict]) -> tuple[CardPriceUpdater, FakeCollection]:
+    coll = FakeCollection(cards)
+    return CardPriceUpdater(CardSnapshot(coll, MARKETS), "yuyutei"), coll
+
+
+def yuyutei_prices(coll: FakeCollection, id: int) -> list[dict]:
+    return coll.find_one({"_id": id})["card_prices"]["yuyutei"]
+
+
+def test_colliding_ids_of_new_prices():
+    updater, coll = create_updater([create_card(1, "AAA-JP001", []), create_card(2, "BBB-JP002", [])])
+    updater.add([create_card_price(42, 100, "AAA-JP001"), create_card_price(42, 555, "BBB-JP002")])
+    updater.execute()
+
+    assert [price["price"] for price in yuyutei_prices(coll, 1)] == [100]
+    assert [price["price"] for price in yuyutei_prices(coll, 2)] == [555]
+
+
+def test_colliding_id_of_a_stored_price():
+    stored = create_card_price(42, 100, "AAA-JP001")
+    updater, coll = create_updater([create_card(1, "AAA-JP001", [stored]), create_card(2, "BBB-JP002", [])])
+    updater.add([create_card_price(42, 555, "BBB-JP002")])
+
+    # The listing of card 2 is added to it, the price of card 1 is not diffed against it
+    assert len(updater.writer.operations) == 1
+    operation = updater.writer.operations[0]
+    assert operation._filter == {"_id": 2}  # pylint: disable=protected-access
+    assert "$addToSet" in operation._doc  # pylint: disable=protected-access
+
+    updater.execute()
+    assert yuyutei_prices(coll, 1) == [stored]
+    assert [price["price"] for price in yuyutei_prices(coll, 2)] == [555]
+
+
+def test_sweep_keeps_the_price_of_a_card_with_a_colliding_id():
+    stored = [create_card_price(42, 100, "AAA-JP001"), create_card_price(43, 100, "AAA-JP001")]
+    updater, _ = create_updater([create_card(1, "AAA-JP001", stored), create_card(2, "BBB-JP002", [])])
+    updater.add([create_card_price(42, 100, "AAA-JP001"), create_card_price(43, 100, "AAA-JP001"), create_card_price(42, 555, "BBB-JP002")])
+    updater.execute()
+    updater.sweep("prune")
+
+    assert set(updater.snapshot.get_price_map("yuyutei")) == {(1, 42), (1, 43), (2, 42)}
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+import trio
+
+from module.utils.json_stream import iter_json_array
+
+
+async def to_chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def read_array(data: bytes, size: int) -> list:
+    async def collect():
+        return [element async for element in iter_json_array(to_chunks(data, size))]
+
+    return trio.run(collect)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 64])
+def test_scalars_split_across_chunks(size):
+    assert read_array(b"[12345, 6789, true, null, -1.5e3, \"ab\"]", size) == [12345, 6789, True, None, -1.5e3, "ab"]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7])
+def test_objects_split_across_chunks(size):
+    cards = [{"konami_id": i, "name": {"en": f"Card {i}", "ja": "カード"}} for i in range(20)]
+    assert read_array(json.dumps(cards, ensure_ascii=False).encode(), size) == cards
+
+
+def test_array_that_ends_early():
+    with pytest.raises(ValueError):
+        read_array(b"[1, 2", 2)